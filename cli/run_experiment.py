@@ -130,8 +130,7 @@ def run_experiment():
 
     if exp.set_variables: # Set state machine variables from experiment specification.
         print('\nSetting state machine variables.')
-        for v_name in exp.set_variables:
-            boards.set_variable(v_name, exp.set_variables[v_name])
+        boards.set_variables(exp.set_variables)
 
     if exp.persistent_variables:
         print('\nPersistent variables ', end = '')
@@ -142,8 +141,7 @@ def run_experiment():
             if os.path.exists(subject_pv_path):
                 with open(subject_pv_path, 'r') as pv_file:
                     pv_dict = eval(pv_file.read())
-                for v_name, v_value in pv_dict.items():
-                    boards.boards[n].set_variable(v_name, v_value)
+                boards.boards[n].set_variables(pv_dict)
                 set_pv.append(subject_ID)
         if len(set_pv) == exp.n_subjects:
             print('set OK.')
@@ -169,9 +167,7 @@ def run_experiment():
         if not os.path.exists(pv_folder):
             os.mkdir(pv_folder)
         for n, subject_ID in exp.subjects.items():
-            pv_dict = {}
-            for v_name in exp.persistent_variables:
-                pv_dict[v_name] = boards.boards[n].get_variable(v_name)
+            pv_dict = boards.boards[n].get_variables(exp.persistent_variables)
             subject_pv_path = os.path.join(pv_folder, '{}.txt'.format(subject_ID))
             with open(subject_pv_path, 'w') as pv_file:
                 pv_file.write(pformat(pv_dict))
@@ -180,13 +176,14 @@ def run_experiment():
         spacing = exp.summary_variables.pop() if isinstance(exp.summary_variables[-1], int) else 1
         if spacing < 1: spacing = 1
         summary_string = ''
+        sv_dicts = boards.get_variables(exp.summary_variables)
         print('\nSummary variables:')
         for v_name in exp.summary_variables:
             print('\n' + v_name + ':')
             v_strings = [v_name + ':\n']
             for n in boards_in_use:
-                v_value = boards.boards[n].get_variable(v_name)
-                boards.boards[n].data_logger.data_file.write('V -1 {} {}\n'.format(v_name, v_value))
+                v_value = sv_dicts[n][v_name]
+                boards.boards[n].data_logger.write_text('V -1 {} {}\n'.format(v_name, v_value))
                 print(exp.subjects[n] + ': {}'.format(v_value))
                 v_strings.append(str(v_value) +'\t' + exp.subjects[n] + '\n')
             v_strings.append('\n' * (spacing-1)) # Add empty lines between variables.
@@ -1,13 +1,70 @@
 import os
+import time
+import queue
+import struct
+import threading
+import numpy as np
 from datetime import datetime
+from tools.data_import import (PCS_FILE_HEADER, PCSB_FILE_HEADER, pcs_header, pcs_strings,
+                               pcs_records, text_session_records)
+
+# Chunked analog file (.pcc) format.  File header: magic 'PCCF' (4 bytes), format version 
+# (2 bytes), reserved (2 bytes).  Each chunk: header 'd r c x n' where d start time (ms) 
+# (float64), r sampling rate (Hz) (2 bytes), c sample typecode (1 byte), x padding (1 byte), 
+# n number of samples (4 bytes), followed by the raw little endian samples.  Sample times
+# are d + i*1000/r for sample i of chunk.  When the file is closed an index is appended with
+# an entry 'o d s' per chunk, where o is chunk file offset (8 bytes), d chunk start time (ms) 
+# (float64) and s index of first sample of chunk in file (8 bytes), followed by a footer 
+# 'o n m' where o is index file offset (8 bytes), n number of index entries (4 bytes) and m 
+# magic 'PCCI'.  Typecodes are struct standard size codes: 'b', 'h', 'i', 'q' (signed 
+# integers of 1, 2, 4 and 8 bytes), upper case for unsigned, and 'f', 'd' for floats.
+
+PCC_VERSION = 1
+PCC_CHUNK_HEADER = '<dHcxI'
+PCC_INDEX_ENTRY = '<QdQ'
+PCC_FOOTER = '<QI4s'
+
+def _pcc_typecode(dtype):
+    # Return struct standard size typecode for numpy dtype of samples.
+    if dtype.kind == 'f':
+        return 'f' if dtype.itemsize == 4 else 'd'
+    code = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}[dtype.itemsize]
+    return code.upper() if dtype.kind == 'u' else code
 
 class Data_logger():
-    '''Class for logging data from a pyControl setup to disk'''
+    '''Class for logging data from a pyControl setup to disk.  If writer_thread is True,
+    data is put on a bounded queue by process_data and written to disk by a background
+    writer thread, so slow disk I/O does not block the caller.  The writer flushes files
+    every flush_interval seconds and fsyncs them every fsync_interval seconds, all pending
+    data is written and synced to disk by close_files.  If binary_session is True a binary
+    session file (.pcs) with typed columns is written alongside the text data file, which 
+    can be loaded much faster than the text file by tools/data_import.'''
 
-    def __init__(self, sm_info=None, print_func=None, data_consumers=[]):
+    def __init__(self, sm_info=None, print_func=None, data_consumers=[], writer_thread=True,
+                 binary_session=False):
         self.data_file = None
+        self.analog_files = {}
         self.print_func = print_func
         self.data_consumers = data_consumers
+        self.dropped_frames = 0 # Number of data frames from board lost due to corrupted data.
+        self.skipped_bytes = 0  # Number of bytes discarded while resynchronising to data frames.
+        self.analog_flush_interval = 1 # Minimum interval between flushes of analog data files (seconds), 0 to flush every chunk.
+        self.analog_flush_time = 0     # time.monotonic() time analog data files were last flushed.
+        self.analog_format = 'pca'     # Analog file format, 'pca' timestamp, value pairs or 'pcc' chunked format.
+        self.analog_index = {}         # {ID: [(chunk offset, start time, first sample)]} for open .pcc files.
+        self.analog_n_samples = {}     # {ID: number of samples written} for open .pcc files.
+        self.use_writer_thread = writer_thread # Whether to write data to disk from writer thread.
+        self.writer_thread = None     # Thread which writes data to disk while data file is open, if used.
+        self.writer_queue = None      # Queue of (time queued, item type, item) to be written by writer thread.
+        self.writer_queue_size = 1000 # Maximum number of items in writer queue, process_data blocks when full.
+        self.flush_interval = 1       # Interval at which writer thread flushes files (seconds).
+        self.fsync_interval = 10      # Interval at which writer thread syncs files to disk (seconds).
+        self.writer_stats = None
+        self.writer_error = None      # Exception raised in writer thread.
+        self.binary_session = binary_session # Whether to write binary session file.
+        self.session_file = None  # Binary session file of fixed size records.
+        self.strings_file = None  # File of text of print, variable, clock and error records.
+        self.strings_offset = 0   # Offset of next string written to strings file.
         if sm_info:
             self.set_state_machine(sm_info)
 
@@ -24,30 +81,76 @@ class Data_logger():
         self.experiment_name = experiment_name
         self.subject_ID = subject_ID
         if datetime_now is None: datetime_now = datetime.now()
+        self.dropped_frames = 0
+        self.skipped_bytes = 0
         file_name = os.path.join(self.subject_ID + datetime_now.strftime('-%Y-%m-%d-%H%M%S') + '.txt')
         self.file_path = os.path.join(self.data_dir, file_name)
         self.data_file = open(self.file_path, 'w', newline = '\n')
-        self.data_file.write('I Experiment name  : {}\n'.format(self.experiment_name))
-        self.data_file.write('I Task name : {}\n'.format(self.sm_info['name']))
-        self.data_file.write('I Subject ID : {}\n'.format(self.subject_ID))
-        self.data_file.write('I Start date : ' + datetime_now.strftime('%Y/%m/%d %H:%M:%S') + '\n\n')
-        self.data_file.write('S {}\n\n'.format(self.sm_info['states'] ))
-        self.data_file.write('E {}\n\n'.format(self.sm_info['events'] ))
+        header = ('I Experiment name  : {}\n'.format(self.experiment_name) +
+                  'I Task name : {}\n'.format(self.sm_info['name']) +
+                  'I Subject ID : {}\n'.format(self.subject_ID) +
+                  'I Start date : ' + datetime_now.strftime('%Y/%m/%d %H:%M:%S') + '\n\n' +
+                  'S {}\n\n'.format(self.sm_info['states']) +
+                  'E {}\n\n'.format(self.sm_info['events']))
+        self.data_file.write(header)
+        if self.binary_session:
+            self._open_session_file(header)
+        if self.use_writer_thread:
+            self._start_writer()
 
     def close_files(self):
+        '''Write any data pending in the writer queue, then flush, sync to disk and close 
+        the data file and analog files.'''
+        self._stop_writer()
         if self.data_file:
+            self._sync_file(self.data_file)
             self.data_file.close()
             self.data_file = None
             self.file_path = None
-        for analog_file in self.analog_files.values():
+        for f in (self.strings_file, self.session_file):
+            if f:
+                self._sync_file(f)
+                f.close()
+        self.session_file = self.strings_file = None
+        for ID, analog_file in self.analog_files.items():
             if analog_file:
+                if ID in self.analog_index: # Chunked format, write index.
+                    self._write_pcc_index(analog_file, self.analog_index.pop(ID))
+                self._sync_file(analog_file)
                 analog_file.close()
-                analog_file = None
+                self.analog_files[ID] = None
+        if self.writer_error:
+            writer_error, self.writer_error = self.writer_error, None
+            raise writer_error
+
+    def write_text(self, text):
+        '''Write text to data file, in order with data passed to process_data.'''
+        if self.writer_thread:
+            self._queue_item('text', text)
+        else:
+            self._write_text_item(text)
+            for f in (self.data_file, self.strings_file, self.session_file):
+                if f:
+                    f.flush()
+
+    def _write_text_item(self, text):
+        '''Write text to data file, and its records to binary session file if open.'''
+        self.data_file.write(text)
+        if self.session_file:
+            self._write_session_records(text_session_records(text.split('\n')))
 
     def process_data(self, new_data):
         '''If data _file is open new data is written to file.  If print_func is specified
         human readable data strings are passed to it.'''
-        if self.data_file:
+        for nd in new_data:
+            if nd[0] == 'F': # Count data lost due to corrupted data.
+                self.dropped_frames += nd[1]
+                self.skipped_bytes += nd[2]
+        if self.writer_error:
+            raise self.writer_error
+        if self.writer_thread:
+            self._queue_item('data', new_data)
+        elif self.data_file:
             self.write_to_file(new_data)
         if self.print_func:
             self.print_func(self.data_to_string(new_data, verbose=True), end='')
@@ -55,27 +158,137 @@ class Data_logger():
             for data_consumer in self.data_consumers:
                 data_consumer.process_data(new_data)
 
-    def write_to_file(self, new_data):
+    def write_to_file(self, new_data, flush=True):
         data_string = self.data_to_string(new_data)
         if data_string:
             self.data_file.write(data_string)
-            self.data_file.flush()
+            if flush:
+                self.data_file.flush()
+        if self.session_file:
+            self._write_session_records(self._data_session_records(new_data))
+            if flush: # Strings first so records never refer to unwritten strings.
+                self.strings_file.flush()
+                self.session_file.flush()
         for nd in new_data:
             if nd[0] == 'A':
                 self.save_analog_chunk(*nd[1:]) 
 
+    # Writer thread ----------------------------------------------------------------
+
+    def _start_writer(self):
+        '''Start thread which writes data from the writer queue to disk.'''
+        self.writer_queue = queue.Queue(maxsize=self.writer_queue_size)
+        self.writer_stats = {'items': 0, 'batches': 0, 'max_queued': 0, 'queue_full': 0,
+                             'total_latency_ms': 0, 'max_latency_ms': 0, 'flushes': 0, 'fsyncs': 0}
+        self.writer_error = None
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+
+    def _stop_writer(self):
+        '''Stop writer thread once all items in the writer queue have been written.'''
+        if self.writer_thread:
+            self.writer_queue.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+
+    def _queue_item(self, item_type, item):
+        '''Put item on writer queue, blocking if queue is full.'''
+        stats = self.writer_stats
+        if self.writer_queue.full():
+            stats['queue_full'] += 1
+        self.writer_queue.put((time.monotonic(), item_type, item))
+        stats['max_queued'] = max(stats['max_queued'], self.writer_queue.qsize())
+
+    def _writer_loop(self):
+        '''Write batches of items from writer queue to disk until a None item is received,
+        flushing and syncing files at flush_interval and fsync_interval.'''
+        stats = self.writer_stats
+        flush_time = fsync_time = time.monotonic()
+        running = True
+        while running:
+            try: # Wait for item or time of next flush.
+                items = [self.writer_queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                items = []
+            while True: # Get all items in queue as a batch.
+                try:
+                    items.append(self.writer_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for item in items:
+                    if item is None: # Stop signal, sent after all other items.
+                        running = False
+                        continue
+                    t_queued, item_type, item = item
+                    if item_type == 'data':
+                        self.write_to_file(item, flush=False)
+                    else:
+                        self._write_text_item(item)
+                    latency_ms = 1000*(time.monotonic() - t_queued)
+                    stats['items'] += 1
+                    stats['total_latency_ms'] += latency_ms
+                    stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+                if items:
+                    stats['batches'] += 1
+                now = time.monotonic()
+                if now - flush_time >= self.flush_interval:
+                    flush_time = now
+                    stats['flushes'] += 1
+                    sync = now - fsync_time >= self.fsync_interval
+                    if sync:
+                        fsync_time = now
+                        stats['fsyncs'] += 1
+                    for f in ([self.data_file, self.strings_file, self.session_file] + 
+                              list(self.analog_files.values())):
+                        if f:
+                            self._sync_file(f, sync)
+            except Exception as e: # Report error to caller and stop writing.
+                self.writer_error = e
+                if running and not any(item is None for item in items):
+                    while self.writer_queue.get() is not None: # Discard items so caller does not block.
+                        pass
+                running = False
+
+    def _sync_file(self, f, sync=True):
+        '''Flush file f, and sync it to disk if sync is True.'''
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+
+    def get_writer_stats(self):
+        '''Return statistics of writer thread for the current or last data file as a dict with 
+        keys 'items' written, 'batches' written, 'max_queued' items, number of times the queue
+        was full ('queue_full'), 'mean_latency_ms' and 'max_latency_ms' from an item being
+        queued to written, and the number of 'flushes' and 'fsyncs'.'''
+        if not self.writer_stats:
+            return None
+        stats = {k: v for k, v in self.writer_stats.items() if k != 'total_latency_ms'}
+        stats['mean_latency_ms'] = (self.writer_stats['total_latency_ms']/stats['items']
+                                    if stats['items'] else 0)
+        return stats
+
     def data_to_string(self, new_data, verbose=False):
         '''Convert list of data tuples into a string.  If verbose=True state and event names are used,
         if verbose=False state and event IDs are used.'''
         data_string = ''
         for nd in new_data:
             if nd[0] == 'D':  # State entry or event.
+                    # Microsecond resolution timestamps are floats, written with 3 decimal places.
+                    t = nd[1] if type(nd[1]) == int else '{:.3f}'.format(nd[1])
                     if verbose: # Print state or event name.
-                        data_string += 'D {} {}\n'.format(nd[1], self.ID2name_fw[nd[2]])
+                        data_string += 'D {} {}\n'.format(t, self.ID2name_fw[nd[2]])
                     else:       # Print state or event ID.
-                        data_string += 'D {} {}\n'.format(nd[1], nd[2])
+                        data_string += 'D {} {}\n'.format(t, nd[2])
             elif nd[0] in ('P', 'V'): # User print output or set variable.
                 data_string += '{} {} {}\n'.format(*nd)
+            elif nd[0] == 'C' and not verbose: # Clock estimate: board time, offset, drift (ppm), error (ms).
+                data_string += 'C {} {:.6f} {:.3f} {:.3f}\n'.format(*nd[1:])
+            elif nd[0] == 'F': # Data frames lost.
+                error_string = 'Data lost: {} frames dropped, {} bytes skipped'.format(*nd[1:])
+                if not verbose:
+                    error_string = '! ' + error_string
+                data_string += error_string + '\n'
             elif nd[0] == '!': # Error
                 error_string = nd[1]
                 if not verbose:
@@ -83,16 +296,93 @@ class Data_logger():
                 data_string += '\n' + error_string + '\n'
         return data_string
 
+    # Binary session file -----------------------------------------------------------
+
+    def _open_session_file(self, header):
+        '''Open binary session file and strings file and write file headers and session header.'''
+        file_stem = os.path.splitext(self.file_path)[0]
+        self.session_file = open(file_stem + '.pcs', 'wb')
+        self.session_file.write(PCS_FILE_HEADER)
+        self.strings_file = open(file_stem + '.pcsb', 'wb')
+        self.strings_file.write(PCSB_FILE_HEADER)
+        header_bytes, _ = pcs_strings([pcs_header(header.split('\n'))], len(PCSB_FILE_HEADER))
+        self.strings_file.write(header_bytes)
+        self.strings_offset = len(PCSB_FILE_HEADER) + len(header_bytes)
+
+    def _write_session_records(self, records):
+        '''Write list of (time, ID, type) records to binary session file as a single array.
+        If ID is a string it is written to the strings file and replaced by its offset.'''
+        if not records:
+            return
+        records_bytes, strings_bytes = pcs_records(records, self.strings_offset)
+        self.strings_file.write(strings_bytes)
+        self.strings_offset += len(strings_bytes)
+        self.session_file.write(records_bytes)
+
+    def _data_session_records(self, new_data):
+        '''Convert list of data tuples into list of binary session file records.'''
+        records = []
+        for nd in new_data:
+            if nd[0] == 'D':
+                records.append((nd[1], nd[2], b'D' if type(nd[1]) == int else b'd'))
+            elif nd[0] in ('P', 'V'):
+                records.append((nd[1], nd[2], nd[0].encode()))
+            elif nd[0] == 'C':
+                records.append((nd[1], '{:.6f} {:.3f} {:.3f}'.format(*nd[2:]), b'C'))
+            elif nd[0] == 'F':
+                records.append((np.nan, 'Data lost: {} frames dropped, {} bytes skipped'
+                                .format(*nd[1:]), b'!'))
+            elif nd[0] == '!':
+                records.append((np.nan, nd[1], b'!'))
+        return records
+
+    # Analog data -------------------------------------------------------------------
+
     def save_analog_chunk(self, ID, sampling_rate, timestamp, data_array):
-        '''Save a chunk of analog data to .pca data file.  File is created if not 
-        already open for that analog input.'''
+        '''Save a chunk of analog data to analog data file, which is created if not 
+        already open for that analog input.  If analog_format is 'pcc' the chunk is 
+        written to a .pcc file as a chunk header and the raw samples.  If analog_format
+        is 'pca' the timestamp and value of each sample are written to a .pca file as 
+        interleaved 4 byte signed integers, built as a single array and written with one
+        call per chunk.  Analog files are flushed at most every analog_flush_interval
+        seconds.'''
         if not self.analog_files[ID]:
             file_name = os.path.splitext(self.file_path)[0] + '_' + \
-                            self.ID2name_hw[ID] + '.pca'
+                            self.ID2name_hw[ID] + '.' + self.analog_format
             self.analog_files[ID] = open(file_name, 'wb')
-        ms_per_sample = 1000 / sampling_rate
-        for i, x in enumerate(data_array):
-            t = int(timestamp + i*ms_per_sample)
-            self.analog_files[ID].write(t.to_bytes(4,'little', signed=True))
-            self.analog_files[ID].write(x.to_bytes(4,'little', signed=True))
-        self.analog_files[ID].flush()
\ No newline at end of file
+            if self.analog_format == 'pcc':
+                self.analog_files[ID].write(b'PCCF' + struct.pack('<HH', PCC_VERSION, 0))
+                self.analog_index[ID] = []
+                self.analog_n_samples[ID] = 0
+        if self.analog_format == 'pcc':
+            self._write_pcc_chunk(ID, sampling_rate, timestamp, data_array)
+        else:
+            ms_per_sample = 1000 / sampling_rate
+            chunk = np.empty((len(data_array), 2), '<i4') # Columns: timestamp, value.
+            chunk[:,0] = (timestamp + np.arange(len(data_array))*ms_per_sample).astype(int)
+            chunk[:,1] = data_array
+            self.analog_files[ID].write(chunk)
+        now = time.monotonic()
+        if now - self.analog_flush_time >= self.analog_flush_interval:
+            self.analog_flush_time = now
+            for analog_file in self.analog_files.values():
+                if analog_file:
+                    analog_file.flush()
+
+    def _write_pcc_chunk(self, ID, sampling_rate, timestamp, data_array):
+        '''Write chunk header and raw samples to .pcc file, and add chunk to file index.'''
+        analog_file = self.analog_files[ID]
+        index = self.analog_index[ID]
+        samples = np.asarray(data_array)
+        samples = samples.astype(samples.dtype.newbyteorder('<'), copy=False)
+        index.append((analog_file.tell(), timestamp, self.analog_n_samples[ID]))
+        self.analog_n_samples[ID] += len(samples)
+        analog_file.write(struct.pack(PCC_CHUNK_HEADER, timestamp, sampling_rate,
+                                      _pcc_typecode(samples.dtype).encode(), len(samples)))
+        analog_file.write(samples)
+
+    def _write_pcc_index(self, analog_file, index):
+        '''Append chunk index and footer to .pcc file.'''
+        index_offset = analog_file.tell()
+        analog_file.write(b''.join([struct.pack(PCC_INDEX_ENTRY, *entry) for entry in index]))
+        analog_file.write(struct.pack(PCC_FOOTER, index_offset, len(index), b'PCCI'))
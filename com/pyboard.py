@@ -21,6 +21,7 @@ Or:
 
 import sys
 import time
+import struct
 import serial
 
 def stdout_write_bytes(b):
@@ -33,30 +34,30 @@ class PyboardError(BaseException):
 class Pyboard:
     def __init__(self, serial_device, baudrate=115200):
         self.serial = serial.Serial(serial_device, baudrate=baudrate, interCharTimeout=1)
+        self.use_raw_paste = True # Set False if board firmware does not support raw-paste mode.
 
     def close(self):
         self.serial.close()
 
     def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
-        data = self.serial.read(min_num_bytes)
-        if data_consumer:
-            data_consumer(data)
-        timeout_count = 0
-        while True:
-            if data.endswith(ending):
-                break
-            elif self.serial.inWaiting() > 0:
+        # Read until data ends with ending, or no data is received for timeout seconds.
+        # Reads block on the serial port timeout rather than polling.
+        self.serial.timeout = timeout
+        try:
+            data = self.serial.read(min_num_bytes)
+            if data_consumer:
+                data_consumer(data)
+            data = bytearray(data)
+            while not data.endswith(ending):
                 new_data = self.serial.read(1)
-                data = data + new_data
+                if not new_data: # Timed out.
+                    break
+                data += new_data
                 if data_consumer:
                     data_consumer(new_data)
-                timeout_count = 0
-            else:
-                timeout_count += 1
-                if timeout is not None and timeout_count >= 10 * timeout:
-                    break
-                time.sleep(0.1)
-        return data
+        finally:
+            self.serial.timeout = None
+        return bytes(data)
 
     def enter_raw_repl(self):
         self.serial.write(b'\r\x03\x03') # ctrl-C twice: interrupt any running program
@@ -95,13 +96,63 @@ class Pyboard:
         # return normal and error output
         return data, data_err
 
+    def raw_paste_write(self, command_bytes):
+        # Read initial header, with window size.
+        data = self.serial.read(2)
+        window_size = struct.unpack('<H', data)[0]
+        window_remain = window_size
+
+        # Write out the command_bytes data.
+        i = 0
+        while i < len(command_bytes):
+            while window_remain == 0 or self.serial.inWaiting():
+                data = self.serial.read(1)
+                if data == b'\x01':
+                    # Device indicated that a new window of data can be sent.
+                    window_remain += window_size
+                elif data == b'\x04':
+                    # Device indicated abrupt end.  Acknowledge it and finish.
+                    self.serial.write(b'\x04')
+                    return
+                else:
+                    # Unexpected data from device.
+                    raise PyboardError('unexpected read during raw paste: {}'.format(data))
+            # Send out as much data as possible that fits within the allowed window.
+            b = command_bytes[i:min(i + window_remain, len(command_bytes))]
+            self.serial.write(b)
+            window_remain -= len(b)
+            i += len(b)
+
+        # Indicate end of data.
+        self.serial.write(b'\x04')
+
+        # Wait for device to acknowledge end of data.
+        data = self.read_until(1, b'\x04')
+        if not data.endswith(b'\x04'):
+            raise PyboardError('could not complete raw paste: {}'.format(data))
+
     def exec_raw_no_follow(self, command):
         if isinstance(command, bytes):
             command_bytes = command
         else:
             command_bytes = bytes(command, encoding='utf8')
 
-        # write command
+        if self.use_raw_paste:
+            # Try to enter raw-paste mode.
+            self.serial.write(b'\x05A\x01')
+            data = self.serial.read(2)
+            if data == b'R\x01':
+                # Device supports raw-paste mode, write out the command using this mode.
+                return self.raw_paste_write(command_bytes)
+            elif data != b'R\x00':
+                # Device doesn't support raw-paste, fall back to normal raw REPL.
+                data = self.read_until(1, b'w REPL; CTRL-B to exit\r\n>')
+                if not data.endswith(b'w REPL; CTRL-B to exit\r\n>'):
+                    raise PyboardError('could not enter raw repl')
+            # Don't try to use raw-paste mode again for this connection.
+            self.use_raw_paste = False
+
+        # write command using standard raw REPL, 256 bytes every 10ms.
         for i in range(0, len(command_bytes), 256):
             self.serial.write(command_bytes[i:min(i + 256, len(command_bytes))])
             time.sleep(0.01)
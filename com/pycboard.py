@@ -2,11 +2,21 @@ import os
 import sys
 import time
 import inspect
+import zlib
+import struct
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
 from serial import SerialException
 from array import array
 from .pyboard import Pyboard, PyboardError
 from config.paths import config_dir, framework_dir, devices_dir, tasks_dir
 
+SYNC_BYTE = 0xA5 # First byte of frame header of data frames sent by board.
+
+DESCRIBE_VERSION = 1 # Version of the state machine description format output by fw.describe().
+
 # ----------------------------------------------------------------------------------------
 #  Helper functions.
 # ----------------------------------------------------------------------------------------
@@ -40,24 +50,125 @@ def _reset_pyb_filesystem():
         if i not in ['System Volume Information', 'boot.py']:
             _rm_dir_or_file(i)
 
-# Used on pyboard for file transfer.
-def _receive_file(file_path, file_size):
+# Used on pyboard to get djb2 hashes of files, files that do not exist are omitted.
+def _file_hashes(file_paths):
+    hashes = {}
+    for file_path in file_paths:
+        try:
+            hashes[file_path] = _djb2_file(file_path)
+        except OSError:
+            pass
+    return hashes
+
+# Used on pyboard for file transfer.  Data is received in 512 byte chunks, each of which
+# is acknowledged.  If compressed_size is non-zero, compressed_size bytes of zlib
+# compressed data are received and decompressed before writing the file.
+def _receive_file(file_path, file_size, compressed_size=0):
     gc.collect()
     usb = pyb.USB_VCP()
     usb.setinterrupt(-1)
+    if '/' in file_path: # Create folder if it does not exist.
+        try:
+            os.mkdir(file_path.rsplit('/', 1)[0])
+        except OSError:
+            pass
     buf_size = 512
-    buf = bytearray(buf_size)
+    n_bytes = compressed_size if compressed_size else file_size
+    buf = bytearray(compressed_size if compressed_size else buf_size)
     buf_mv = memoryview(buf)
-    bytes_remaining = file_size
     with open(file_path, 'wb') as f:
-        while bytes_remaining > 0:
-            bytes_read = usb.recv(buf, timeout=5)
+        bytes_received = 0
+        while bytes_received < n_bytes:
+            chunk_size = min(buf_size, n_bytes - bytes_received)
+            i = bytes_received if compressed_size else 0
+            n = 0
+            while n < chunk_size:
+                bytes_read = usb.recv(buf_mv[i+n:i+chunk_size], timeout=5000)
+                if not bytes_read:
+                    raise OSError('file transfer timed out')
+                n += bytes_read
             usb.write(b'0')
-            if bytes_read:
-                bytes_remaining -= bytes_read
-                f.write(buf_mv[:bytes_read])
+            bytes_received += chunk_size
+            if not compressed_size:
+                f.write(buf_mv[:chunk_size])
+        if compressed_size:
+            import zlib
+            f.write(zlib.decompress(buf, 15))
     gc.collect()
 
+# Encode variables {v_name: v_value} in the typed format decoded on pyboard by
+# fw.decode_variables.  If v_value is None for all variables only names are encoded,
+# used to request variable values.
+def _encode_variables(v_dict, names_only=False):
+    data = bytearray()
+    for v_name, v_value in v_dict.items():
+        data += bytes([len(v_name)]) + v_name.encode()
+        if names_only:
+            data += b'-'
+        elif v_value is True or v_value is False or v_value is None:
+            data += {True: b'T', False: b'F', None: b'N'}[v_value]
+        elif type(v_value) == int and -2**31 <= v_value < 2**31:
+            data += b'i' + struct.pack('<i', v_value)
+        elif type(v_value) == float:
+            data += b'f' + struct.pack('<f', v_value)
+        else:
+            v_bytes = (v_value if type(v_value) == str else repr(v_value)).encode()
+            data += (b's' if type(v_value) == str else b'r') + struct.pack('<H', len(v_bytes)) + v_bytes
+    return bytes(data)
+
+# Convert latency histogram from board into dict with summary statistics.
+def _histogram_dict(bin_width, max_us, counts):
+    n = sum(counts)
+    cum_counts = [sum(counts[:i+1]) for i in range(len(counts))]
+    def percentile(p): # Upper edge of bin containing p'th percentile, or max if in last bin.
+        i = next(i for i, c in enumerate(cum_counts) if c >= p*n/100)
+        return max_us if i == len(counts)-1 else min((i+1)*bin_width, max_us)
+    return {'bin_width': bin_width, 'counts': counts, 'n': n, 'max': max_us,
+            'median': percentile(50) if n else None, 'p99': percentile(99) if n else None}
+
+# ----------------------------------------------------------------------------------------
+#  Clock_estimator class.
+# ----------------------------------------------------------------------------------------
+
+class Clock_estimator():
+    '''Estimate the offset and drift of the board clock relative to host wall-clock time 
+    from ping/echo samples.  Each sample pairs the board time in the echo with the midpoint 
+    of the host times at which the ping was sent and the echo received, which corrects for
+    the USB round trip assuming it is symmetric.  Samples whose round trip time is above 
+    the median are discarded as delayed by transport jitter, and host time is linearly
+    regressed on board time for the remaining samples.'''
+
+    def __init__(self, max_samples=1000):
+        self.samples = deque(maxlen=max_samples) # (host time (s), board time (ms), round trip (s))
+        self.wall_offset = time.time() - time.perf_counter() # Converts perf_counter to wall-clock time.
+        self.estimate = None
+
+    def add_sample(self, t_sent, t_received, board_ms):
+        '''Add sample from ping sent and echo received at perf_counter times t_sent and 
+        t_received, with board time board_ms.  Return updated estimate or None if there
+        are not yet enough samples.'''
+        # Board times are truncated to whole ms, add 0.5 ms to centre them on the true time.
+        self.samples.append(((t_sent + t_received)/2 + self.wall_offset, board_ms + 0.5, 
+                             t_received - t_sent))
+        if len(self.samples) >= 3:
+            self.estimate = self._fit()
+        return self.estimate
+
+    def _fit(self):
+        '''Return estimate as dict with keys: 'offset', wall-clock time (s) of board time 0,
+        'drift_ppm', difference in rate of host and board clocks in parts per million, 
+        positive if the board clock runs slow, 'error_ms', estimated error of board times mapped to wall-clock time, and 
+        'n_samples'.  Wall-clock time of board time t (ms) is given by:
+        offset + t*(1 + drift_ppm*1e-6)/1000.'''
+        host_t, board_t, round_trip = np.array(self.samples).T
+        host_t0 = host_t[0] # Subtracted from host times for numerical precision of fit.
+        keep = round_trip <= np.median(round_trip)
+        slope, offset = np.polyfit(board_t[keep], host_t[keep] - host_t0, 1)
+        residuals = host_t[keep] - host_t0 - (offset + slope*board_t[keep])
+        return {'offset': float(host_t0 + offset), 'drift_ppm': float((slope*1000 - 1)*1e6), 
+                'error_ms': float(1000*(np.median(round_trip[keep])/2 + np.std(residuals))),
+                'n_samples': len(self.samples)}
+
 # ----------------------------------------------------------------------------------------
 #  Pycboard class.
 # ----------------------------------------------------------------------------------------
@@ -72,6 +183,26 @@ class Pycboard(Pyboard):
         self.print = print_func        # Function used for print statements.
         self.data_logger = data_logger # Instance of Data_logger class for saving and printing data.
         self.status = {'serial': None, 'framework':None, 'usb_mode':None}
+        self.latency_stats = None # Latency histograms most recently received from board.
+        self.input_buffer = bytearray() # Data received from board that has not yet been processed.
+        self.next_seq = 0       # Expected sequence number of next frame received from board.
+        self.resyncing = False  # True while skipping invalid data to find start of next frame.
+        self.skipped_bytes = 0  # Bytes skipped while resynchronising since last valid frame.
+        self.reader_thread = None # Thread which reads data from serial line during run, if used.
+        self.reader_queue = deque() # Parsed data handed from reader thread to process_data.
+        self.reader_queue_size = 1000 # Reader thread pauses reading while queue holds this many items.
+        self.serial_buffer_size = 4096 # Size of OS serial input buffer, used to detect overflow.
+        self.reader_stats = None
+        self.sm_info_cache = {} # {task file hash: state machine information}, cleared when framework or hardware definition is loaded.
+        self.task_hash = None   # djb2 hash of task file most recently transferred to board.
+        self.variable_requests = {} # {request_ID: (future, deadline)} for pending variable reads during run.
+        self.next_request_ID = 0    # ID of next variable read request (modulo 2**16).
+        self.clock_estimator = None # Clock_estimator instance if clock sync is used during run.
+        self.ping_interval = 1      # Interval between clock sync pings (seconds).
+        self.pings_sent = {}        # {ping_ID: perf_counter time ping was sent}.
+        self.next_ping_ID = 0       # ID of next clock sync ping (modulo 2**16).
+        self.last_ping_time = 0     # perf_counter time last ping was sent.
+        self.read_time = 0          # perf_counter time of last serial read which received data.
         try:    
             super().__init__(self.serial_port, baudrate=115200)
             self.status['serial'] = True
@@ -101,8 +232,9 @@ class Pycboard(Pyboard):
     def reset(self):
         '''Enter raw repl (soft reboots pyboard), import modules.'''
         self.enter_raw_repl() # Soft resets pyboard.
-        self.exec(inspect.getsource(_djb2_file))  # define djb2 hashing function.
-        self.exec(inspect.getsource(_receive_file))  # define recieve file function.
+        self.exec(inspect.getsource(_djb2_file) +    # define djb2 hashing functions.
+                  inspect.getsource(_file_hashes) +
+                  inspect.getsource(_receive_file))  # define recieve file function.
         self.exec('import os; import gc; import sys; import pyb')
         self.framework_running = False
         error_message = None
@@ -189,51 +321,84 @@ class Pycboard(Pyboard):
         '''Copy file at file_path to location target_path on pyboard.'''
         if not target_path:
             target_path = os.path.split(file_path)[-1]
-        file_size = os.path.getsize(file_path)
-        file_hash = _djb2_file(file_path)
+        self.transfer_files([file_path], [target_path])
+
+    def transfer_files(self, file_paths, target_paths, compress=False, window=8, show_progress=False):
+        '''Copy files at file_paths to locations target_paths on pyboard.  The hashes of
+        all target files are got from the pyboard in a single command and only files whose
+        hash does not match the local file are sent, then all hashes are checked again and
+        any files that do not match are resent.  Files are sent in 512 byte chunks with up
+        to window chunks awaiting acknowledgement.  If compress is True files are zlib
+        compressed for transfer, the compressed file must fit in pyboard memory.'''
+        local_hashes = {t: _djb2_file(f) for f, t in zip(file_paths, target_paths)}
         try:
             for i in range(10):
-                    if file_hash == self.get_file_hash(target_path):
-                        return
-                    try:
-                        self.remove_file(file_path)
-                    except PyboardError:
-                        pass
-                    self.exec_raw_no_follow("_receive_file('{}',{})"
-                                            .format(target_path, file_size))
-                    with open(file_path, 'rb') as f:
-                        while True:
-                            chunk = f.read(512)
-                            if not chunk:
-                                break
-                            self.serial.write(chunk)
-                            self.serial.read(1)
-                    self.follow(5)
+                board_hashes = eval(self.eval('_file_hashes({})'.format(repr(target_paths))).decode())
+                changed = [(f, t) for f, t in zip(file_paths, target_paths) 
+                           if board_hashes.get(t) != local_hashes[t]]
+                if not changed:
+                    return
+                for file_path, target_path in changed:
+                    self._send_file(file_path, target_path, compress, window)
+                    if show_progress:
+                        self.print('.', end='')
+                        sys.stdout.flush()
         except PyboardError as e:
-            self.print('\n\nError: Unable to transfer file.')
-            raise PyboardError
+            self.print('\n\nError: Unable to transfer file. {}'.format(e))
+            raise
+        self.print('\n\nError: Unable to transfer file.')
+        raise PyboardError
+
+    def _send_file(self, file_path, target_path, compress, window):
+        '''Send file to pyboard with up to window chunks awaiting acknowledgement.  Raises
+        PyboardError if an acknowledgement is not received within 5 seconds or is not the 
+        expected byte.'''
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        file_size = len(data)
+        if compress:
+            data = zlib.compress(data, 9)
+        self.exec_raw_no_follow("_receive_file('{}',{},{})"
+                                .format(target_path, file_size, len(data) if compress else 0))
+        n_chunks = (len(data) + 511)//512
+        n_acked = 0
+        self.serial.timeout = 5
+        try:
+            for i in range(n_chunks):
+                self.serial.write(data[i*512:(i+1)*512])
+                if i + 1 - n_acked == window: # Wait for oldest chunk to be acknowledged.
+                    self._read_acks(1)
+                    n_acked += 1
+            self._read_acks(n_chunks - n_acked)
+        finally:
+            self.serial.timeout = None
+        self.follow(5)
+
+    def _read_acks(self, n):
+        '''Read n chunk acknowledgements from the pyboard, raise PyboardError if any are
+        missing or unexpected.'''
+        acks = self.serial.read(n)
+        if acks != b'0'*n:
+            raise PyboardError('Expected {} file transfer acknowledgement(s), received {!r}.'
+                               .format(n, acks))
 
     def transfer_folder(self, folder_path, target_folder=None, file_type='all',
                         show_progress=False):
         '''Copy a folder into the root directory of the pyboard.  Folders that
         contain subfolders will not be copied successfully.  To copy only files of
         a specific type, change the file_type argument to the file suffix (e.g. 'py').'''
+        self.transfer_files(*self._folder_paths(folder_path, target_folder, file_type),
+                            show_progress=show_progress)
+
+    def _folder_paths(self, folder_path, target_folder=None, file_type='all'):
+        '''Return lists of local file paths and pyboard target paths for files in folder.'''
         if not target_folder:
             target_folder = os.path.split(folder_path)[-1]
-        files = os.listdir(folder_path)
+        files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
         if file_type != 'all':
             files = [f for f in files if f.split('.')[-1] == file_type]
-        try:
-            self.exec('os.mkdir({})'.format(repr(target_folder)))
-        except PyboardError:
-            pass # Folder already exists.
-        for f in files:
-            file_path = os.path.join(folder_path, f)
-            target_path = target_folder + '/' + f
-            self.transfer_file(file_path, target_path)
-            if show_progress:
-                self.print('.', end='')
-                sys.stdout.flush()
+        return ([os.path.join(folder_path, f) for f in files], 
+                [target_folder + '/' + f for f in files])
 
     def remove_file(self, file_path):
         '''Remove a file from the pyboard.'''
@@ -255,8 +420,11 @@ class Pycboard(Pyboard):
     def load_framework(self, framework_dir=framework_dir):
         '''Copy the pyControl framework folder to the board.'''
         self.print('\nTransfering pyControl framework to pyboard.', end='')
-        self.transfer_folder(framework_dir, file_type='py', show_progress=True)
-        self.transfer_folder(devices_dir  , file_type='py', show_progress=True)
+        framework_files, framework_targets = self._folder_paths(framework_dir, file_type='py')
+        devices_files  , devices_targets   = self._folder_paths(devices_dir  , file_type='py')
+        self.transfer_files(framework_files + devices_files, framework_targets + devices_targets,
+                            show_progress=True)
+        self.sm_info_cache = {}
         error_message = self.reset()
         if not self.status['framework']:
             self.print('\nError importing framework:')
@@ -271,6 +439,7 @@ class Pycboard(Pyboard):
         if os.path.exists(hwd_path):
             self.print('\nTransfering hardware definition to pyboard.', end='')
             self.transfer_file(hwd_path, target_path = 'hardware_definition.py')
+            self.sm_info_cache = {}
             self.reset()
             try:
                 self.exec('import hardware_definition')
@@ -284,7 +453,10 @@ class Pycboard(Pyboard):
 
     def setup_state_machine(self, sm_name, sm_dir=tasks_dir, uploaded=False):
         '''Transfer state machine descriptor file sm_name.py from folder sm_dir
-        to board. Instantiate state machine object as state_machine on pyboard.'''
+        to board. Instantiate state machine object as state_machine on pyboard.
+        Information about the state machine is read from the board with a single call
+        to fw.describe() and cached by task file hash, so setting up an unchanged task 
+        again does not read it from the board.'''
         self.reset()
         if uploaded:
             self.print('\n Resetting task. ', end='')
@@ -294,27 +466,54 @@ class Pycboard(Pyboard):
                 self.print('Error: State machine file not found at: ' + sm_path)
                 raise PyboardError('State machine file not found at: ' + sm_path)
             self.print('\nTransfering state machine {} to pyboard. '.format(sm_name), end='')
+            self.task_hash = None
             self.transfer_file(sm_path, 'task_file.py')
+            self.task_hash = _djb2_file(sm_path)
         self.gc_collect()
         try:
-            self.exec('import task_file as smd')
-            self.exec('state_machine = sm.State_machine(smd)')
+            self.exec('import task_file as smd; state_machine = sm.State_machine(smd)')
             self.print('OK')
         except PyboardError as e:
             self.print('\n\nError: Unable to setup state machine.\n\n' + e.args[2].decode())
             raise PyboardError('Unable to setup state machine.', e.args[2])
         # Get information about state machine.
-        states = self.get_states()
-        events = self.get_events()
+        if self.task_hash in self.sm_info_cache:
+            sm_info = self.sm_info_cache[self.task_hash]
+        else:
+            sm_info = self.describe()
+            if self.task_hash is not None:
+                self.sm_info_cache[self.task_hash] = sm_info
         self.sm_info = {'name'  : sm_name,
-                        'states': states, # {name:ID}
-                        'events': events, # {name:ID}
-                        'ID2name': {ID: name for name, ID in {**states, **events}.items()}, # {ID:name}
-                        'analog_inputs': self.get_analog_inputs(), # {name: {'ID': ID, 'Fs':sampling rate}}
-                        'variables': self.get_variables()} # {name: repr(value)}
+                        'states': sm_info['states'], # {name:ID}
+                        'events': sm_info['events'], # {name:ID}
+                        'ID2name': sm_info['ID2name'], # {ID:name}
+                        'analog_inputs': sm_info['analog_inputs'], # {name: {'ID': ID, 'Fs':sampling rate}}
+                        'variables': dict(sm_info['variables'])} # {name: repr(value)}, copied as updated during run.
         if self.data_logger:
             self.data_logger.set_state_machine(self.sm_info)
 
+    def describe(self):
+        '''Return information about the state machine on the board as a dictionary with
+        keys 'states', 'events', 'ID2name', 'analog_inputs' and 'variables', read with 
+        a single call to fw.describe().'''
+        lines = self.exec('fw.describe()').decode().splitlines()
+        if not lines or lines[0] != 'D {}'.format(DESCRIBE_VERSION):
+            raise PyboardError('Unsupported state machine description format, reload framework.')
+        sm_info = {'states': {}, 'events': {}, 'analog_inputs': {}, 'variables': {}}
+        for line in lines[1:]:
+            item_type, name, value = line.split('\t', 2)
+            if item_type == 'S':
+                sm_info['states'][name] = int(value)
+            elif item_type == 'E':
+                sm_info['events'][name] = int(value)
+            elif item_type == 'A':
+                ID, Fs = value.split('\t')
+                sm_info['analog_inputs'][name] = {'ID': int(ID), 'Fs': int(Fs)}
+            elif item_type == 'V':
+                sm_info['variables'][name] = value
+        sm_info['ID2name'] = {ID: name for name, ID in {**sm_info['states'], **sm_info['events']}.items()}
+        return sm_info
+
     def get_states(self):
         '''Return states as a dictionary {state_name: state_ID}'''
         return eval(self.exec('fw.get_states()').decode().strip())
@@ -323,80 +522,470 @@ class Pycboard(Pyboard):
         '''Return events as a dictionary {event_name: state_ID}'''
         return eval(self.exec('fw.get_events()').decode().strip())
 
-    def get_variables(self):
-        '''Return variables as a dictionary {variable_name: value}'''
-        return eval(self.exec('fw.get_variables()').decode().strip())
-
     def get_analog_inputs(self):
         '''Return analog_inputs as a directory {input name: ID}'''
         return eval(self.exec('hw.get_analog_inputs()').decode().strip())
 
-    def start_framework(self, dur=None, data_output=True):
-        '''Start pyControl framwork running on pyboard.'''
+    def get_latency_stats(self):
+        '''Return event latency statistics recorded by the board when the framework is run
+        with instrument=True, as a dictionary {'event_latency', 'queue_wait', 'handler_time'}
+        with a histogram dictionary for each measure. Durations are in microseconds.  The 
+        dictionary also has key 'stale', True if the stats are not from the current request.
+        If the framework is running, the board is requested to send its current histograms,
+        which are received by a later call to process_data, and the stats most recently 
+        received are returned with 'stale' True, or None if none have been received.'''
+        if self.framework_running:
+            self.serial.write(b'L')
+            return dict(self.latency_stats, stale=True) if self.latency_stats else None
+        stats = eval(self.exec('fw.get_latency_stats()').decode().strip())
+        self.latency_stats = {name: _histogram_dict(h['bin_width'], h['max'], h['counts'])
+                              for name, h in stats.items()}
+        return dict(self.latency_stats, stale=False)
+
+    def get_loop_stats(self):
+        '''Return main loop profiling statistics from the last framework run started with 
+        profile=True as a dictionary with keys 'run_ms', 'max_iteration_us', 'idle_fraction'
+        and an entry {'count', 'total_us', 'fraction', 'mean_us'} for each update priority
+        level.  Can only be called when the framework is not running.'''
+        return eval(self.exec('fw.get_loop_stats()').decode().strip())
+
+    def get_queue_stats(self):
+        '''Return usage statistics for the event and data output queues from the last
+        framework run as a dictionary {queue name: {'length', 'high_water', 'overflows'}}'''
+        return eval(self.exec('fw.get_queue_stats()').decode().strip())
+
+    def get_gc_stats(self):
+        '''Return garbage collection statistics from the last framework run as a dictionary
+        with keys 'collections', 'forced', 'starved', 'heap_size', 'heap_min_free' and 
+        'pause_us', a histogram dictionary of collection durations.  'starved' is the number
+        of forced collections that occurred while a scheduled collection was waiting for 
+        time to run.  Collections are only counted if the framework was run with 
+        gc_schedule=True.'''
+        stats = eval(self.exec('fw.get_gc_stats()').decode().strip())
+        h = stats['pause_us']
+        stats['pause_us'] = _histogram_dict(h['bin_width'], h['max'], h['counts'])
+        return stats
+
+    def start_framework(self, dur=None, data_output=True, batch_output=False, tickless=False,
+                        instrument=False, profile=False, fast_dispatch=False, drain_limit=1,
+                        drain_budget_us=1000, high_res=False, gc_schedule=False, reader_thread=False,
+                        clock_sync=False):
+        '''Start pyControl framwork running on pyboard. If batch_output is True the 
+        board sends multiple data records per serial frame to reduce USB overheads.
+        If tickless is True the framework runs without the 1kHz clock tick interrupt.
+        If instrument is True the board records event latency histograms which are
+        sent at the end of the run, see get_latency_stats. If profile is True the board
+        records main loop timing statistics, see get_loop_stats. If fast_dispatch is True
+        events are dispatched to the state machine by ID rather than name. If drain_limit
+        is greater than 1 the board processes up to drain_limit items from each priority
+        level per update pass, ending passes after drain_budget_us microseconds. If
+        high_res is True, events generated by hardware inputs and analog data chunks
+        have microsecond resolution timestamps, returned as float milliseconds. If 
+        gc_schedule is True automatic garbage collection is disabled during the run and 
+        the board collects when idle, see get_gc_stats.  If reader_thread is True data is
+        read from the serial line and parsed by a background thread during the run, and
+        process_data returns data parsed since it was last called, see get_reader_stats.
+        If clock_sync is True the computer pings the board every ping_interval seconds when
+        process_data is called, and estimates of board clock offset and drift relative to 
+        host wall-clock time are output as C data tuples, see get_clock_estimate.  Receive
+        times are most accurate when reader_thread is also True.'''
         self.gc_collect()
-        self.exec('fw.data_output = ' + repr(data_output))
+        options = {'data_output': data_output, 'batch_output': batch_output, 
+                   'instrument': instrument, 'profile': profile, 'fast_dispatch': fast_dispatch,
+                   'drain_limit': drain_limit, 'drain_budget_us': drain_budget_us,
+                   'high_res': high_res, 'gc_schedule': gc_schedule}
+        self.exec('; '.join(['fw.{} = {}'.format(k, repr(v)) for k, v in options.items()]))
+        self._stop_reader()
         self.serial.reset_input_buffer()
-        self.exec_raw_no_follow('fw.run({})'.format(dur))
+        self.input_buffer.clear()
+        self.next_seq = 0
+        self.resyncing = False
+        self.skipped_bytes = 0
+        self.clock_estimator = Clock_estimator() if clock_sync else None
+        self.pings_sent.clear()
+        self.exec_raw_no_follow('fw.run({}, {})'.format(dur, tickless))
         self.framework_running = True
+        if reader_thread:
+            self._start_reader()
 
     def stop_framework(self):
-        '''Stop framework running on pyboard by sending stop command.'''
+        '''Stop framework running on pyboard by sending stop command.  If the reader thread 
+        is running, wait for it to receive the end of the run so the serial line is free 
+        for REPL commands, data it has parsed is returned by the next call to process_data.
+        If the reader is stopped before receiving the end of the run, e.g. as it was paused
+        with the reader queue full, the remaining data is read from the serial line.'''
         self.serial.write(b'\x03') # Stop signal
         self.framework_running = False
+        if self.reader_thread:
+            self.reader_thread.join(timeout=1)
+            self._stop_reader()
+            if not any(run_ended for t, data, error, run_ended in self.reader_queue):
+                self._drain_serial()
+
+    def _drain_serial(self, timeout=1):
+        '''Read and parse data remaining on the serial line after the reader thread has 
+        stopped, until the end of the framework run is received or no data is received for
+        timeout seconds.  Data is appended to the reader queue to be returned by process_data.'''
+        last_read_time = time.time()
+        while time.time() - last_read_time < timeout:
+            if not self._read_serial():
+                time.sleep(0.001)
+                continue
+            last_read_time = time.time()
+            new_data, error_message, run_ended = self._parse_input()
+            if new_data or error_message or run_ended:
+                self.reader_queue.append((time.time(), new_data, error_message, run_ended))
+            if run_ended:
+                break
 
     def process_data(self):
-        '''Read data from serial line, generate list new_data of data tuples, 
-        pass new_data to data_logger and print_func if specified, return new_data.'''
+        '''Read data from serial line, generate list new_data of data tuples, pass new_data
+        to data_logger and print_func if specified.  If the reader thread is running, the
+        data parsed by the thread since process_data was last called is used, otherwise
+        data available on the serial line is read and parsed.'''
+        if (self.clock_estimator and self.framework_running and
+                time.perf_counter() - self.last_ping_time >= self.ping_interval):
+            self.ping()
+        if self.reader_thread or self.reader_queue:
+            new_data, error_message, run_ended = self._drain_reader()
+        else:
+            self._read_serial()
+            new_data, error_message, run_ended = self._parse_input()
+        if run_ended:
+            self.framework_running = False
+        if new_data and self.data_logger:
+            self.data_logger.process_data(new_data)
+        if error_message:
+            raise PyboardError(error_message)
+
+    def _read_serial(self):
+        '''Read all data available on serial line into input buffer, return number of bytes read.'''
+        n_waiting = self.serial.inWaiting()
+        if n_waiting:
+            self.input_buffer.extend(self.serial.read(n_waiting))
+            self.read_time = time.perf_counter()
+        return n_waiting
+
+    def _parse_input(self):
+        '''Parse the complete data frames in the input buffer, return (new_data, error_message,
+        run_ended) where new_data is a list of data tuples and run_ended is True if the end of 
+        the framework run was received.  Partial frames are kept in the input buffer until the
+        remainder of the frame is received.  Each frame starts with a frame header containing
+        a sync byte and sequence number.  If an invalid frame is received the parser skips to
+        the start of the next valid frame, and the number of frames dropped and bytes skipped
+        are reported with an ('F', n_frames, n_bytes) tuple.'''
         new_data = []
         error_message = None
-        while self.serial.inWaiting() > 0:
-            new_byte = self.serial.read(1)  
-            if new_byte == b'A': # Analog data, 13 byte header + variable size content.
-                data_header = self.serial.read(13)
-                typecode      = data_header[0:1].decode()             
-                ID            = int.from_bytes(data_header[1:3], 'little')
-                sampling_rate = int.from_bytes(data_header[3:5], 'little')
-                data_len      = int.from_bytes(data_header[5:7], 'little')
-                timestamp     = int.from_bytes(data_header[7:11], 'little')
-                checksum      = int.from_bytes(data_header[11:13], 'little')
-                data_array    = array(typecode, self.serial.read(data_len))
-                if checksum == (sum(data_header[:-2]) + sum(data_array)) & 0xffff: # Checksum OK.
-                    new_data.append(('A',ID, sampling_rate, timestamp, data_array))
-                else:
-                    new_data.append(('!','bad checksum A'))
-            elif new_byte == b'D': # Event or state entry, 8 byte data header only.
-                data_header = self.serial.read(8)
-                timestamp = int.from_bytes(data_header[ :4], 'little')
-                ID        = int.from_bytes(data_header[4:6], 'little')
-                checksum  = int.from_bytes(data_header[6:8], 'little')
-                if checksum == sum(data_header[:-2]): # Checksum OK.
-                    new_data.append(('D',timestamp, ID))
-                else:
-                    new_data.append(('!','bad checksum D'))
-            elif new_byte in (b'P', b'V'): # User print statement or set variable, 8 byte data header + variable size content.
-                data_header = self.serial.read(8)
-                data_len  = int.from_bytes(data_header[ :2], 'little')
-                timestamp = int.from_bytes(data_header[2:6], 'little')
-                checksum  = int.from_bytes(data_header[6:8], 'little')
-                data_bytes = self.serial.read(data_len)
-                if not checksum == (sum(data_header[:-2]) + sum(data_bytes)) & 0xffff: # Bad checksum.
-                    new_data.append(('!','bad checksum ' + new_byte.decode()))
+        run_ended = False
+        buf = self.input_buffer
+        n = len(buf)
+        i = 0 # Index of start of next frame in buffer.
+        while i < n:
+            if self.resyncing: # Skip to start of next frame.
+                k = self._find_sync(buf, i, n)
+                if k == -1 and buf.endswith(b'\x04>'): # Framework run ended.
+                    k = buf.rfind(b'\x04', i, n-2)
+                if k == -1: # Wait for more data.
+                    break
+                self.skipped_bytes += k - i
+                i = k
+                self.resyncing = False
+            if buf[i] == SYNC_BYTE: # Data frame.
+                if i + 4 > n:
+                    break
+                seq = buf[i+1]
+                if seq ^ buf[i+2] == 0xFF:
+                    try:
+                        frame_data, j = self._parse_frame(buf, i+3, n)
+                    except Exception as e: # Frame contents could not be parsed, treat as invalid.
+                        new_data.append(('!', 'Error parsing data frame: {!r}'.format(e)))
+                        frame_data = False
+                else: # Corrupted frame header.
+                    frame_data = False
+                if frame_data is None: # Incomplete frame.
+                    break
+                if frame_data is False: # Invalid frame.
+                    self.resyncing = True
+                    self.skipped_bytes += 1
+                    i += 1
                     continue
-                new_data.append((new_byte.decode(),timestamp, data_bytes.decode()))
-                if new_byte == b'V': # Store new variable value in sm_info
-                    v_name, v_str = data_bytes.decode().split(' ', 1)
-                    self.sm_info['variables'][v_name] = eval(v_str)
-            elif new_byte == b'\x04': # End of framework run.
-                self.framework_running = False
-                data_err = self.read_until(2, b'\x04>', timeout=10) 
+                n_dropped = (seq - self.next_seq) & 0xFF
+                if n_dropped or self.skipped_bytes:
+                    new_data.append(('F', n_dropped, self.skipped_bytes))
+                    self.skipped_bytes = 0
+                self.next_seq = (seq + 1) & 0xFF
+                new_data.extend(frame_data)
+                i = j
+            elif buf[i] == 4: # End of framework run.
+                run_ended = True
+                if self.skipped_bytes: # Data was lost after last valid frame.
+                    new_data.append(('F', 0, self.skipped_bytes))
+                    self.skipped_bytes = 0
+                data_err = bytes(buf[i+1:])
+                i = n
+                while not data_err.endswith(b'\x04>'):
+                    new_bytes = self.read_until(1, b'>', timeout=10)
+                    if not new_bytes:
+                        break
+                    data_err += new_bytes
                 if len(data_err) > 2:
                     error_message = data_err[:-3].decode()
                     new_data.append(('!', error_message))                
                 break
-        if new_data and self.data_logger:
-            self.data_logger.process_data(new_data)
-        if error_message:
-            raise PyboardError(error_message)
+            else: # Not at start of frame.
+                self.resyncing = True
+        del buf[:i]
+        if self.variable_requests:
+            self._expire_requests(run_ended)
+        return new_data, error_message, run_ended
+
+    def _start_reader(self):
+        '''Start thread which reads and parses data from serial line until the framework run ends.'''
+        self.reader_queue.clear()
+        self.reader_stats = {'batches': 0, 'total_wait_ms': 0, 'max_wait_ms': 0, 'max_queued': 0,
+                             'stalls': 0, 'max_in_waiting': 0, 'buffer_full': 0}
+        self.reader_stop = False
+        self.reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self.reader_thread.start()
+
+    def _stop_reader(self):
+        '''Stop reader thread if running.'''
+        if self.reader_thread:
+            self.reader_stop = True
+            self.reader_thread.join()
+            self.reader_thread = None
+
+    def _reader_loop(self):
+        '''Read and parse data from serial line, appending (time, new_data, error_message,
+        run_ended) tuples to the reader queue, until the end of the framework run is received
+        or the reader is stopped.  If the queue is full reading pauses until it is drained.'''
+        stats = self.reader_stats
+        while not self.reader_stop:
+            if len(self.reader_queue) >= self.reader_queue_size: # Wait for process_data.
+                stats['stalls'] += 1
+                time.sleep(0.001)
+                continue
+            try:
+                n_read = self._read_serial()
+                new_data, error_message, run_ended = self._parse_input()
+            except (SerialException, OSError) as e:
+                n_read, new_data, error_message, run_ended = 0, [], str(e), True
+            except Exception as e: # Unexpected error, discard buffered data and resynchronise.
+                self.skipped_bytes += len(self.input_buffer)
+                self.input_buffer.clear()
+                self.resyncing = True
+                n_read, error_message, run_ended = 0, None, False
+                new_data = [('!', 'Error reading data: {!r}'.format(e))]
+            stats['max_in_waiting'] = max(stats['max_in_waiting'], n_read)
+            if n_read >= self.serial_buffer_size:
+                stats['buffer_full'] += 1
+            if new_data or error_message or run_ended:
+                self.reader_queue.append((time.time(), new_data, error_message, run_ended))
+                stats['max_queued'] = max(stats['max_queued'], len(self.reader_queue))
+            if run_ended:
+                break
+            if not n_read:
+                time.sleep(0.001)
+
+    def _drain_reader(self):
+        '''Get data parsed by reader thread from reader queue, return (new_data, 
+        error_message, run_ended).'''
+        new_data = []
+        error_message = None
+        run_ended = False
+        stats = self.reader_stats
+        while self.reader_queue:
+            t, data, error, ended = self.reader_queue.popleft()
+            wait_ms = 1000*(time.time() - t)
+            stats['batches'] += 1
+            stats['total_wait_ms'] += wait_ms
+            stats['max_wait_ms'] = max(stats['max_wait_ms'], wait_ms)
+            new_data.extend(data)
+            if error:
+                error_message = error
+            if ended:
+                run_ended = True
+                self._stop_reader()
+        return new_data, error_message, run_ended
+
+    def get_reader_stats(self):
+        '''Return statistics for the reader thread from the current or last framework run
+        as a dictionary with keys 'batches' (number of data batches handed to process_data),
+        'mean_wait_ms' and 'max_wait_ms' (time batches waited before being processed),
+        'max_queued' (maximum batches waiting), 'stalls' (times the reader paused as queue 
+        was full), 'max_in_waiting' (most bytes waiting in the OS serial buffer at a read)
+        and 'buffer_full' (reads at which the OS serial buffer was full, indicating data 
+        may have been lost).  Returns None if the reader thread has not been used.'''
+        if not self.reader_stats:
+            return None
+        stats = dict(self.reader_stats)
+        stats['mean_wait_ms'] = stats.pop('total_wait_ms')/stats['batches'] if stats['batches'] else 0
+        return stats
+
+    def close(self):
+        '''Stop reader thread if running and close serial connection.'''
+        self._stop_reader()
+        super().close()
+
+    def _find_sync(self, buf, i, n):
+        '''Return the index of the first possible frame header at or after index i of buffer
+        buf whose valid data ends at index n, or -1 if there is none.'''
+        k = buf.find(SYNC_BYTE, i, n)
+        while k != -1 and k + 2 < n and buf[k+1] ^ buf[k+2] != 0xFF:
+            k = buf.find(SYNC_BYTE, k+1, n)
+        return k
+
+    def _parse_frame(self, buf, i, n):
+        '''Parse data frame following frame header, starting at index i of buffer buf whose
+        valid data ends at index n.  Return (frame_data, j) where frame_data is a list of 
+        data tuples and j the index of the end of the frame.  frame_data is None if the 
+        buffer does not contain the complete frame and False if the frame is invalid.'''
+        frame_type = buf[i]
+        if frame_type in (65, 97): # A or a, analog data, 13 (A) or 15 (a) byte header + variable size content.
+            j = i + (14 if frame_type == 65 else 16) # Index of start of content.
+            if j > n:
+                return None, i
+            typecode, ID, sampling_rate, data_len, timestamp = struct.unpack_from('<cHHHI', buf, i+1)
+            if j + data_len > n:
+                return None, i
+            if frame_type == 97: # Chunk start time has microsecond resolution.
+                timestamp += struct.unpack_from('<H', buf, i+12)[0]/1000
+            checksum = struct.unpack_from('<H', buf, j-2)[0]
+            try:
+                typecode = typecode.decode()
+                data_array = array(typecode)
+                data_array.frombytes(buf[j:j+data_len])
+            except (UnicodeDecodeError, ValueError): # Corrupted typecode or data length.
+                return False, i
+            data_sum = int(np.frombuffer(buf, typecode, data_len//data_array.itemsize, j).sum())
+            if not checksum == (sum(buf[i+1:j-2]) + data_sum) & 0xffff: # Bad checksum.
+                return False, i
+            return [('A',ID, sampling_rate, timestamp, data_array)], j + data_len
+        elif frame_type in (68, 100, 80, 86): # D, d, P or V, event, state entry, print or variable record.
+            data_tuples, j = self._parse_record(buf, i, n)
+            if data_tuples is None:
+                return None, i
+            if data_tuples[0][0] == '!': # Bad checksum.
+                return False, i
+            return data_tuples, j
+        elif frame_type == 84: # T, clock sync echo, 8 byte data header only.
+            if i + 9 > n:
+                return None, i
+            ping_ID, board_ms, checksum = struct.unpack_from('<HIH', buf, i+1)
+            if not checksum == sum(buf[i+1:i+7]): # Bad checksum.
+                return False, i
+            return self._clock_sample(ping_ID, board_ms), i + 9
+        elif frame_type in (77, 76): # M or L, batch of D, d, P and V records or latency histograms.
+            header_len = 4 if frame_type == 77 else 8
+            j = i + 1 + header_len # Index of start of content.
+            if j > n:
+                return None, i
+            data_len = struct.unpack_from('<H', buf, i+1)[0]
+            if j + data_len > n:
+                return None, i
+            checksum = struct.unpack_from('<H', buf, j-2)[0]
+            if not checksum == (sum(buf[i+1:j-2]) + sum(buf[j:j+data_len])) & 0xffff: # Bad checksum.
+                return False, i
+            frame_data = []
+            if frame_type == 77: # Parse batched records.
+                k = j
+                while k < j + data_len:
+                    data_tuples, k = self._parse_record(buf, k, j + data_len)
+                    if data_tuples is None: # Record extends beyond end of batch.
+                        frame_data.append(('!','bad record M'))
+                        break
+                    frame_data.extend(data_tuples)
+            else: # Parse latency histograms.
+                self.latency_stats = {}
+                k = j
+                for name in ('event_latency', 'queue_wait', 'handler_time'):
+                    bin_width, n_bins, max_us = struct.unpack_from('<HHI', buf, k)
+                    counts = array('I', buf[k+8:k+8+4*n_bins]).tolist()
+                    self.latency_stats[name] = _histogram_dict(bin_width, max_us, counts)
+                    k += 8+4*n_bins
+            return frame_data, j + data_len
+        return False, i # Unrecognised frame type.
+
+    def _parse_record(self, buf, i, n):
+        '''Parse D, d, P or V data record starting at index i of buffer buf whose valid
+        data ends at index n.  Return (list of data tuples, index of end of record), or
+        (None, i) if the buffer does not contain the complete record.  Events with microsecond
+        resolution timestamps (d records) are returned as D tuples with float timestamp.  
+        V records are returned as one V tuple per variable.'''
+        record_type = buf[i]
+        if record_type == 68: # D, event or state entry, 8 byte data header only.
+            if i + 9 > n:
+                return None, i
+            timestamp, ID, checksum = struct.unpack_from('<IHH', buf, i+1)
+            if checksum == sum(buf[i+1:i+7]): # Checksum OK.
+                return [('D',timestamp, ID)], i + 9
+            else:
+                return [('!','bad checksum D')], i + 9
+        elif record_type == 100: # d, event with microsecond timestamp, 10 byte data header only.
+            if i + 11 > n:
+                return None, i
+            timestamp, ID, micros, checksum = struct.unpack_from('<IHHH', buf, i+1)
+            if checksum == sum(buf[i+1:i+9]): # Checksum OK.
+                return [('D',timestamp + micros/1000, ID)], i + 11
+            else:
+                return [('!','bad checksum d')], i + 11
+        else: # P or V, user print statement or set variable, 8 byte data header + variable size content.
+            if i + 9 > n:
+                return None, i
+            data_len, timestamp, checksum = struct.unpack_from('<HIH', buf, i+1)
+            j = i + 9 + data_len # Index of end of record.
+            if j > n:
+                return None, i
+            if not checksum == (sum(buf[i+1:i+7]) + sum(buf[i+9:j])) & 0xffff: # Bad checksum.
+                return [('!','bad checksum ' + chr(record_type))], j
+            data_string = buf[i+9:j].decode()
+            if record_type == 86: # V, store new variable values in sm_info
+                v_lines = data_string.split('\n')
+                request_ID = None
+                if v_lines[0][:2] == '# ': # Response to variable request.
+                    request_ID = int(v_lines.pop(0)[2:])
+                v_values = {}
+                for v_line in v_lines:
+                    v_name, v_str = v_line.split(' ', 1)
+                    v_values[v_name] = eval(v_str)
+                    self.sm_info['variables'][v_name] = v_values[v_name]
+                if request_ID is not None:
+                    self._resolve_request(request_ID, v_values)
+                return [('V', timestamp, v_line) for v_line in v_lines], j
+            return [(chr(record_type), timestamp, data_string)], j
+
+    def ping(self):
+        '''Send clock sync ping to running framework, the board echoes the ping ID with its
+        current time, see _clock_sample.'''
+        ping_ID = self.next_ping_ID
+        self.next_ping_ID = (ping_ID + 1) & 0xFFFF
+        self.last_ping_time = time.perf_counter()
+        self.pings_sent = {ID: t for ID, t in self.pings_sent.items() # Discard unanswered pings.
+                           if self.last_ping_time - t < 10}
+        self.pings_sent[ping_ID] = self.last_ping_time
+        self.serial.write(b'T' + ping_ID.to_bytes(2, 'little'))
+
+    def _clock_sample(self, ping_ID, board_ms):
+        '''Add clock sync sample from echo of ping ping_ID with board time board_ms, 
+        received at the time of the last serial read.  Return list containing data tuple 
+        ('C', board_ms, offset, drift_ppm, error_ms) with the updated clock estimate, or 
+        empty list if no estimate is available.  The receive time is only as accurate as
+        the serial read timing: the reader thread reads within ~1ms of data arriving, but 
+        without it data is read when process_data is called, so round trip times and 
+        error_ms are inflated by up to the process_data polling interval.'''
+        t_sent = self.pings_sent.pop(ping_ID, None)
+        if t_sent is None or not self.clock_estimator:
+            return []
+        estimate = self.clock_estimator.add_sample(t_sent, self.read_time, board_ms)
+        if not estimate:
+            return []
+        return [('C', board_ms, estimate['offset'], estimate['drift_ppm'], estimate['error_ms'])]
+
+    def get_clock_estimate(self):
+        '''Return the latest estimate of board clock offset and drift relative to host 
+        wall-clock time from a run started with clock_sync=True, see Clock_estimator._fit,
+        or None if no estimate is available.'''
+        return self.clock_estimator.estimate if self.clock_estimator else None
 
     # ------------------------------------------------------------------------------------
     # Getting and setting variables.
@@ -406,34 +995,109 @@ class Pycboard(Pyboard):
         '''Set the value of a state machine variable. If framework is not running
         returns True if variable set OK, False if set failed.  Returns None framework
         running, but variable event is later output by board.'''
-        if v_name not in self.sm_info['variables']:
-            raise PyboardError('Invalid variable name: {}'.format(v_name))
-        v_str = repr(v_value)
-        if self.framework_running: # Set variable with serial command.
-            data = repr((v_name, v_str)).encode() + b's'
-            data_len = len(data).to_bytes(2, 'little')
-            checksum = sum(data).to_bytes(2, 'little')
-            self.serial.write(b'V' + data_len +  data + checksum)
-            return None
-        else: # Set variable using REPL.  
-            checksum = sum(v_str.encode())
-            set_OK = eval(self.eval("state_machine._set_variable({}, {}, {})"
-                .format(repr(v_name), repr(v_str), checksum)).decode())
-            if set_OK:
-                self.sm_info['variables'][v_name] = v_str
-            return set_OK
+        return self.set_variables({v_name: v_value})
 
     def get_variable(self, v_name):
         '''Get the value of a state machine variable. If framework not running returns
         variable value if got OK, None if get fails.  Returns None if framework 
         running, but variable event is later output by board.'''
-        if v_name not in self.sm_info['variables']:
-            raise PyboardError('Invalid variable name: {}'.format(v_name))        
-        if self.framework_running: # Get variable with serial command.
-            data = v_name.encode() + b'g'
-            data_len = len(data).to_bytes(2, 'little')
-            checksum = sum(data).to_bytes(2, 'little')
-            self.serial.write(b'V' + data_len +  data + checksum)
-        else: # Get variable using REPL.
-            return eval(self.eval("state_machine._get_variable({})"
-                                  .format(repr(v_name))).decode())
\ No newline at end of file
+        v_values = self.get_variables([v_name])
+        return v_values[v_name] if v_values else None
+
+    def set_variables(self, v_dict):
+        '''Set the values of multiple state machine variables {v_name: v_value} with a
+        single command.  Values are sent in a typed binary encoding so the board only 
+        evaluates strings for values that are not int, float, bool, None or str.  If 
+        framework is not running returns True if all variables set OK, False if set 
+        failed.  Returns None if framework running, but a single variable event with 
+        the new values is later output by board.'''
+        for v_name in v_dict:
+            if v_name not in self.sm_info['variables']:
+                raise PyboardError('Invalid variable name: {}'.format(v_name))
+        data = _encode_variables(v_dict)
+        if self.framework_running: # Set variables with serial command.
+            self._send_variables_command(data + b'S')
+            return None
+        else: # Set variables using REPL.  
+            set_OK = eval(self.exec("fw.set_variables({}, {})"
+                .format(repr(data), sum(data) & 0xFFFF)).decode().strip())
+            if set_OK:
+                for v_name, v_value in v_dict.items():
+                    self.sm_info['variables'][v_name] = repr(v_value)
+            return set_OK
+
+    def get_variables(self, v_names=None):
+        '''Get the values of multiple state machine variables with a single command, 
+        defaults to all variables. If framework not running returns dict {v_name: v_value}.
+        Returns None if framework running, but a single variable event with the values is 
+        later output by board.'''
+        if v_names is None:
+            v_names = list(self.sm_info['variables'])
+        for v_name in v_names:
+            if v_name not in self.sm_info['variables']:
+                raise PyboardError('Invalid variable name: {}'.format(v_name))        
+        if self.framework_running: # Get variables with serial command.
+            self.get_variables_async(v_names)
+        else: # Get variables using REPL.
+            v_strs = eval(self.exec('fw.get_variables()').decode().strip())
+            return {v_name: eval(v_strs[v_name]) for v_name in v_names}
+
+    def get_variables_async(self, v_names=None, timeout=1):
+        '''Request the values of state machine variables, defaults to all variables, and
+        return a concurrent.futures.Future which is resolved with dict {v_name: v_value}.
+        If the framework is running, the request is sent as a serial command with a request
+        ID, and the future is resolved when the matching response from the board is parsed
+        by process_data or the reader thread.  The future fails with PyboardError if the 
+        response is not received within timeout seconds or the run ends first.  If the 
+        framework is not running, the values are read using the REPL and a completed future
+        is returned.  Use asyncio.wrap_future to await the future in asyncio code.'''
+        future = Future()
+        if not self.framework_running:
+            future.set_result(self.get_variables(v_names))
+            return future
+        if v_names is None:
+            v_names = list(self.sm_info['variables'])
+        for v_name in v_names:
+            if v_name not in self.sm_info['variables']:
+                raise PyboardError('Invalid variable name: {}'.format(v_name))
+        request_ID = self.next_request_ID
+        self.next_request_ID = (request_ID + 1) & 0xFFFF
+        self.variable_requests[request_ID] = (future, time.time() + timeout)
+        self._send_variables_command(request_ID.to_bytes(2, 'little') + _encode_variables(
+            {v_name: None for v_name in v_names}, names_only=True) + b'G')
+        return future
+
+    def get_variable_async(self, v_name, timeout=1):
+        '''Request the value of a state machine variable, return a concurrent.futures.Future 
+        resolved with the variable value, see get_variables_async.'''
+        future = Future()
+        def values_done(values_future):
+            if values_future.exception():
+                future.set_exception(values_future.exception())
+            else:
+                future.set_result(values_future.result()[v_name])
+        self.get_variables_async([v_name], timeout).add_done_callback(values_done)
+        return future
+
+    def _resolve_request(self, request_ID, v_values):
+        '''Resolve the future of variable request request_ID with values v_values.'''
+        future, deadline = self.variable_requests.pop(request_ID, (None, None))
+        if future and not future.done():
+            future.set_result(v_values)
+
+    def _expire_requests(self, run_ended=False):
+        '''Fail futures of variable requests whose timeout has elapsed, or all pending 
+        requests if the framework run has ended.'''
+        now = time.time()
+        for request_ID, (future, deadline) in list(self.variable_requests.items()):
+            if run_ended or now > deadline:
+                self.variable_requests.pop(request_ID, None)
+                if not future.done():
+                    future.set_exception(PyboardError('No response to variable request {}{}.'
+                        .format(request_ID, ', run ended' if run_ended else '')))
+
+    def _send_variables_command(self, data):
+        '''Send get/set variables command with content data to running framework.'''
+        data_len = len(data).to_bytes(2, 'little')
+        checksum = (sum(data) & 0xFFFF).to_bytes(2, 'little')
+        self.serial.write(b'V' + data_len +  data + checksum)
\ No newline at end of file
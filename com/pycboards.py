@@ -1,6 +1,7 @@
 import os
 from time import sleep
 from pprint import pformat
+from concurrent.futures import ThreadPoolExecutor
 from .pycboard import Pycboard 
 from .pyboard import PyboardError
 from com.data_logger import Data_logger
@@ -17,47 +18,76 @@ def print_func_factory(n):
 # Pycboards --------------------------------------------------------------------------
 
 class Pycboards():
-    'Perform operations on a group of Pycboards.'
+    '''Perform operations on a group of Pycboards.  Operations are run on all boards
+    concurrently using a thread pool with one thread per board, see call_all.  If 
+    start_framework is called with reader_thread=True each board's data is read by its
+    own reader thread, so process_data collects data from all boards without blocking
+    on any serial port.'''
 
     def __init__(self, numbers): 
-        self.boards = {}
         self.numbers = sorted(numbers)
-        for n in numbers:
+        self.executor = ThreadPoolExecutor(max_workers=max(len(self.numbers), 1))
+        self.results = {} # {board_number: result} from last call_all.
+        self.errors = {}  # {board_number: exception} from last call_all.
+        def open_board(n):
             print('\nOpening connection to board {}'.format(n))
-            self.boards[n] = Pycboard(config.board_serials[n], 
+            return Pycboard(config.board_serials[n], 
                 data_logger=Data_logger(print_func=print_func_factory(n)))
+        self.boards = self.call_all(open_board)
         self.unique_IDs = {n: self.boards[n].unique_ID for n in self.boards}
 
+    def call_all(self, func, numbers=None):
+        '''Call func(n) concurrently for each board number n in numbers (default all boards)
+        and return results as dict {board_number: result}.  Results and exceptions raised
+        for each board are stored in attributes results and errors.  If func raised an
+        exception for any board, PyboardError is raised once all calls have finished.'''
+        if numbers is None: numbers = self.numbers
+        futures = {n: self.executor.submit(func, n) for n in numbers}
+        self.results, self.errors = {}, {}
+        for n, future in futures.items():
+            try:
+                self.results[n] = future.result()
+            except (Exception, PyboardError) as e: # PyboardError is a BaseException subclass.
+                self.errors[n] = e
+        if self.errors:
+            raise PyboardError('Error on board(s) {}\n'.format(sorted(self.errors)) + 
+                '\n'.join('Box {}: {!r}'.format(n, e) for n, e in sorted(self.errors.items())))
+        return self.results
+
     def reset(self):
-        for board in self.boards.values():
-            board.reset()       
+        return self.call_all(lambda n: self.boards[n].reset())
 
     def hard_reset(self):
-        for board in self.boards.values():
-            board.hard_reset()   
+        return self.call_all(lambda n: self.boards[n].hard_reset())
 
     def reset_filesystem(self):
-        for board in self.boards.values():
-            board.reset_filesystem()
+        return self.call_all(lambda n: self.boards[n].reset_filesystem())
 
     def setup_state_machine(self, sm_name, sm_dir=tasks_dir):
-        for board in self.boards.values():
-            board.setup_state_machine(sm_name, sm_dir)
-
-    def start_framework(self, dur=None, data_output=True, ISI=False):
-        for n in self.numbers:
-            self.boards[n].start_framework(dur, data_output)
-            if ISI:
-                sleep(ISI)  # Stagger start times by ISI seconds.       
+        return self.call_all(lambda n: self.boards[n].setup_state_machine(sm_name, sm_dir))
+
+    def start_framework(self, dur=None, data_output=True, ISI=False, clock_sync=False,
+                        reader_thread=False):
+        '''Start framework on all boards. If clock_sync is True the offset and drift of each
+        board's clock relative to host wall-clock time are estimated and logged to the data
+        files during the run, the estimates are most accurate if reader_thread is also True.
+        If reader_thread is True each board's data is read and parsed by its own reader
+        thread, see Pycboard.start_framework.'''
+        if ISI: # Start boards in order, staggering start times by ISI seconds.
+            for n in self.numbers:
+                self.boards[n].start_framework(dur, data_output, reader_thread=reader_thread,
+                                               clock_sync=clock_sync)
+                sleep(ISI)
                 self.boards[n].process_data()
+        else:
+            return self.call_all(lambda n: self.boards[n].start_framework(
+                dur, data_output, reader_thread=reader_thread, clock_sync=clock_sync))
 
     def load_framework(self):
-        for board in self.boards.values():
-            board.load_framework()
+        return self.call_all(lambda n: self.boards[n].load_framework())
 
     def load_hardware_definition(self):
-        for board in self.boards.values():
-            board.load_hardware_definition()            
+        return self.call_all(lambda n: self.boards[n].load_hardware_definition())
 
     def process_data(self):
         boards_running = False
@@ -75,15 +105,14 @@ class Pycboards():
         self.start_framework(dur)
         try:
             while self.process_data():
-                pass
+                sleep(0.01)
         except KeyboardInterrupt:
             self.stop_framework()
         sleep(0.1)
         self.process_data()
 
     def stop_framework(self):
-        for board in self.boards.values():
-            board.stop_framework()
+        return self.call_all(lambda n: self.boards[n].stop_framework())
 
     def print_IDs(self):
         for board in self.boards.values():
@@ -94,19 +123,29 @@ class Pycboards():
         the board ID numbers, the variable on each board is set to the corresponding value
         from the dictionary.  Otherwise the variable on all boards is set to v_value.'''
         if type(v_value) == dict and set(self.boards.keys()) == set(v_value.keys()): 
-            for n in self.numbers:
-                self.boards[n].set_variable(v_name, v_value[n])
+            return self.call_all(lambda n: self.boards[n].set_variable(v_name, v_value[n]))
         else:
-            for board in self.boards.values():
-                board.set_variable(v_name, v_value)
+            return self.call_all(lambda n: self.boards[n].set_variable(v_name, v_value))
 
     def get_variable(self, v_name):
         '''Get value of specified variable from all boards and return as dict with 
         board numbers as keys.'''
-        v_values = {}
-        for n in self.numbers:
-            v_values[n] = self.boards[n].get_variable(v_name)
-        return v_values
+        return self.call_all(lambda n: self.boards[n].get_variable(v_name))
+
+    def set_variables(self, v_dict):
+        '''Set multiple variables {v_name: v_value} on all pycboards, with a single command
+        per board.  As for set_variable, if a v_value is a dict whose keys are the board ID
+        numbers, the variable on each board is set to the corresponding value.'''
+        def board_values(n):
+            return {v_name: v_value[n] if (type(v_value) == dict and 
+                    set(self.boards.keys()) == set(v_value.keys())) else v_value
+                    for v_name, v_value in v_dict.items()}
+        return self.call_all(lambda n: self.boards[n].set_variables(board_values(n)))
+
+    def get_variables(self, v_names):
+        '''Get values of specified variables from all boards with a single command per
+        board and return as dict with board numbers as keys.'''
+        return self.call_all(lambda n: self.boards[n].get_variables(v_names))
 
     def open_data_file(self, data_dir, experiment_name, subject_IDs, datetime_now=None):
         for n, board in self.boards.items():
@@ -123,6 +162,7 @@ class Pycboards():
     def close(self):
         for board in self.boards.values():
             board.close()
+        self.executor.shutdown()
 
     def save_unique_IDs(self):
         print('Saving hardware unique IDs.')
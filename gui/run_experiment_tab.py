@@ -159,6 +159,7 @@ class Run_experiment_tab(QtGui.QWidget):
                         subject_pv_dict = persistent_variables[board.subject]
                     except KeyError:
                         subject_pv_dict = {}
+                    v_dict = {} # Variables to set {v_name: v_value}, set with a single command.
                     for v in board.subject_variables:
                         if v['persistent'] and v['name'] in subject_pv_dict.keys(): # Use stored value.
                             v_value =  subject_pv_dict[v['name']]
@@ -169,7 +170,9 @@ class Run_experiment_tab(QtGui.QWidget):
                                 continue
                             v_value = eval(v['value'], variable_constants) # Use value from variables table.
                             board.variables_set_pre_run.append((v['name'], v['value'], ''))
-                        board.set_variable(v['name'], v_value)
+                        v_dict[v['name']] = v_value
+                    if v_dict:
+                        board.set_variables(v_dict)
                     # Print set variables to log.    
                     if board.variables_set_pre_run:
                         name_len  = max([len(v[0]) for v in board.variables_set_pre_run])
@@ -203,8 +206,8 @@ class Run_experiment_tab(QtGui.QWidget):
             board.data_logger.open_data_file(ex['data_dir'], ex['name'], board.subject, self.start_time)
             if board.subject_variables: # Write variables set pre run to data file.
                 for v_name, v_value, pv in board.variables_set_pre_run:
-                    board.data_logger.data_file.write('V 0 {} {}\n'.format(v_name, v_value))
-            board.data_logger.data_file.write('\n')
+                    board.data_logger.write_text('V 0 {} {}\n'.format(v_name, v_value))
+            board.data_logger.write_text('\n')
             board.start_framework()
         self.GUI_main.refresh_timer.stop()
         self.update_timer.start(update_interval)
@@ -229,17 +232,18 @@ class Run_experiment_tab(QtGui.QWidget):
         for i, board in enumerate(self.boards):
             #  Store persistent variables.
             subject_pvs = [v for v in board.subject_variables if v['persistent']]
+            # Read persistent and summary variables with a single command.
+            v_names = list({v['name'] for v in subject_pvs + summary_variables})
+            v_values = board.get_variables(v_names) if v_names else {}
             if subject_pvs:
                 board.print('\nStoring persistent variables.')
                 persistent_variables[board.subject] = {
-                    v['name']: board.get_variable(v['name']) for v in subject_pvs}
-            # Read summary variables.
+                    v['name']: v_values[v['name']] for v in subject_pvs}
             if summary_variables:
-                sv_dict[board.subject] = {v['name']: board.get_variable(v['name'])
+                sv_dict[board.subject] = {v['name']: v_values[v['name']]
                                           for v in summary_variables}
                 for v_name, v_value in sv_dict[board.subject].items():
-                    board.data_logger.data_file.write('\nV -1 {} {}'.format(v_name, v_value))
-                    board.data_logger.data_file.flush()
+                    board.data_logger.write_text('\nV -1 {} {}'.format(v_name, v_value))
         if persistent_variables:
             with open(self.pv_path, 'w') as pv_file:
                 pv_file.write(json.dumps(persistent_variables, sort_keys=True, indent=4))
@@ -1,5 +1,14 @@
+import gc
 from array import array
 import pyb
+try:
+    import heapq
+except ImportError:
+    import uheapq as heapq
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
 from . import hardware as hw
 
 class pyControlError(BaseException): # Exception for pyControl errors.
@@ -14,8 +23,12 @@ print_typ = const(4) # User print.
 hardw_typ = const(5) # Harware callback
 stopf_typ = const(6) # Stop framework.
 varbl_typ = const(7) # Variable change.
+anchr_typ = const(8) # High resolution clock anchor update.
+cancl_typ = const(0) # Cancelled timer.
 
-# Generic event tuple format used by Event_queue and Timer class: (timestamp, event_type, event_data)
+describe_version = const(1) # Version of the state machine description format output by describe().
+
+# Generic event format used by Event_queue and Timer class: (timestamp, event_type, event_data)
 
 # Specific event tuple types:
 
@@ -25,94 +38,254 @@ varbl_typ = const(7) # Variable change.
 # (time, print_typ, print_string)   # User print.
 # (time, hardw_typ, hardware_ID)    # Harware callback
 # (time, stopf_typ, None)           # Stop framework.
-# (time, varbl_typ, (v_name, v_str) # Variable changed.
+# (time, varbl_typ, [(v_name, v_str)]) # Variables changed.
+# (time, anchr_typ, None)           # High resolution clock anchor update.
 
 # Event_queue -----------------------------------------------------------------
 
 class Event_queue():  
-    # First-in first-out event queue.
-    def __init__(self):
+    # First-in first-out event queue.  Events are stored in a fixed size ring buffer 
+    # with seperate arrays for timestamp, event type and ID, and a list for the data
+    # of print and variable events.  Calling get() stores the fields of the next event
+    # in attributes timestamp, event_type and event_data.  If an event is put into a full
+    # queue it is discarded and the overflows count is incremented, the first overflow 
+    # since the queue was last empty is reported to the computer as a print record 
+    # sent immediately, bypassing the data output queue.  If timing is True and
+    # latency instrumentation or high resolution timestamps are on, the pyb.micros() time 
+    # each event was put in the queue and the time of the interrupt that generated it are
+    # stored in attributes put_us and origin_us when it is got, origin_us is -1 if the event
+    # was not generated by an interrupt.
+    def __init__(self, buffer_length=50, timing=False, name='event queue'):
+        self.buffer_length = buffer_length
+        self.name = name
+        self.timing = timing
+        self.timestamps  = array('i', [0] * buffer_length)
+        self.event_types = array('i', [0] * buffer_length)
+        self.event_IDs   = array('i', [0] * buffer_length)
+        self.payloads = [None] * buffer_length # Data for print and variable events.
+        if timing:
+            self.put_micros    = array('i', [0] * buffer_length)
+            self.origin_micros = array('i', [0] * buffer_length)
         self.reset()
 
     def reset(self):
         # Empty queue.
-        self.Q = []
+        self.read_ind  = 0
+        self.write_ind = 0
+        self.n_items   = 0
         self.available = False
-
-    def put(self, event_tuple):
+        self.overflows = 0   # Number of events discarded as queue was full.
+        self.overflow_reported = False # True if overflow reported since queue was last empty.
+        self.high_water = 0  # Maximum number of events in queue.
+        self.timestamp  = 0
+        self.event_type = 0
+        self.event_data = None
+        self.put_us = -1
+        self.origin_us = -1
+        for i in range(self.buffer_length):
+            self.payloads[i] = None
+
+    def put(self, timestamp, event_type, event_data, origin_us=-1):
         # Put event in queue.  
-        self.Q.append(event_tuple)
+        if self.n_items == self.buffer_length:
+            self.overflows += 1
+            if data_output and not self.overflow_reported:
+                self.overflow_reported = True
+                output_data(current_time, print_typ, 'Error: {} full, events discarded.'.format(self.name))
+            return
+        if self.timing and record_micros:
+            self.put_micros[self.write_ind] = pyb.micros()
+            self.origin_micros[self.write_ind] = origin_us
+        self.timestamps[self.write_ind]  = timestamp
+        self.event_types[self.write_ind] = event_type
+        if event_type in (print_typ, varbl_typ):
+            self.payloads[self.write_ind] = event_data
+        else:
+            self.event_IDs[self.write_ind] = event_data
+        self.write_ind = (self.write_ind + 1) % self.buffer_length
+        self.n_items += 1
+        if self.n_items > self.high_water:
+            self.high_water = self.n_items
         self.available = True
 
     def get(self):
-        # Get event tuple from queue
-        self.available = len(self.Q) > 1
-        return(self.Q.pop(0))
+        # Get next event from queue, storing its fields in attributes timestamp,
+        # event_type and event_data.
+        self.timestamp  = self.timestamps[self.read_ind]
+        self.event_type = self.event_types[self.read_ind]
+        if self.event_type in (print_typ, varbl_typ):
+            self.event_data = self.payloads[self.read_ind]
+            self.payloads[self.read_ind] = None
+        else:
+            self.event_data = self.event_IDs[self.read_ind]
+        if self.timing and record_micros:
+            self.put_us = self.put_micros[self.read_ind]
+            self.origin_us = self.origin_micros[self.read_ind]
+        self.read_ind = (self.read_ind + 1) % self.buffer_length
+        self.n_items -= 1
+        self.available = self.n_items > 0
+        if not self.available:
+            self.overflow_reported = False
+
+    def stats(self):
+        # Return dict of queue usage statistics.
+        return {'length': self.buffer_length, 'high_water': self.high_water,
+                'overflows': self.overflows}
+
+# Histogram -------------------------------------------------------------------
+
+class Histogram():
+    # Histogram of durations (us) with n_bins bins of width bin_width, durations 
+    # longer than the histogram range are counted in the last bin.
+    def __init__(self, bin_width=20, n_bins=50):
+        self.bin_width = bin_width
+        self.n_bins = n_bins
+        self.counts = array('I', [0] * n_bins)
+        self.reset()
+
+    def reset(self):
+        for i in range(self.n_bins):
+            self.counts[i] = 0
+        self.max = 0
+
+    def add(self, x):
+        self.counts[min(x // self.bin_width, self.n_bins-1)] += 1
+        if x > self.max:
+            self.max = x
+
+    def to_bytes(self):
+        # Return histogram as bytes: bin_width (2 bytes), n_bins (2 bytes), max (4 bytes), counts (4 bytes each).
+        return (self.bin_width.to_bytes(2, 'little') + self.n_bins.to_bytes(2, 'little') + 
+                self.max.to_bytes(4, 'little') + bytes(self.counts))
+
+    def get(self):
+        # Return histogram as dict.
+        return {'bin_width': self.bin_width, 'max': self.max, 'counts': list(self.counts)}
 
 # Timer -----------------------------------------------------------------------
 
 class Timer():
+    # Timers are stored in a binary heap of entries [trigger_time, sequence_n, event_type, event_data],
+    # the sequence number ensures timers with equal trigger times elapse in the order they were set.
+    # Timers are cancelled lazily by setting their event_type to cancl_typ, cancelled entries are
+    # discarded when they reach the top of the heap.  User timers are indexed by event_ID and timed
+    # state transitions are kept in a seperate list so they can be found without searching the heap.
 
     def __init__(self):
         self.reset()
 
     def reset(self):
-        self.active_timers = [] # list of event tuples: (trigger_time, event_type, data)
-        self.paused_timers = [] # list of event tuples: (trigger_time, event_type, data)
+        self.heap = []          # Heap of timer entries: [trigger_time, sequence_n, event_type, event_data]
+        self.ID_index = {}      # {event_ID: [entry, ...]} for active user timers (event_typ, timer_typ).
+        self.state_timers = []  # Active timed state transitions (state_typ).
+        self.paused_timers = {} # {event_ID: [(time_remaining, event_type), ...]}
+        self.sequence_n = 0     # Incremented each time a timer is set.
+        self.n_cancelled = 0    # Number of cancelled entries in heap.
         self.available = False
-    
+
     def set(self, interval, event_type, event_data):
         # Set a timer to trigger specified event after 'interval' ms has elapsed.
         global current_time
-        self.active_timers.append((current_time+int(interval), event_type, event_data))
-        self.active_timers.sort(reverse=True)
+        self._push(current_time+int(interval), event_type, event_data)
+
+    def _push(self, trigger_time, event_type, event_data):
+        # Add timer entry to heap and index.
+        entry = [trigger_time, self.sequence_n, event_type, event_data]
+        self.sequence_n += 1
+        heapq.heappush(self.heap, entry)
+        if event_type in (event_typ, timer_typ):
+            try:
+                self.ID_index[event_data].append(entry)
+            except KeyError:
+                self.ID_index[event_data] = [entry]
+        elif event_type == state_typ:
+            self.state_timers.append(entry)
+
+    def _cancel(self, entry):
+        # Mark entry as cancelled, compact heap if mostly cancelled entries.
+        entry[2] = cancl_typ
+        self.n_cancelled += 1
+        if self.n_cancelled > 16 and 2*self.n_cancelled > len(self.heap):
+            self.heap = [e for e in self.heap if e[2] != cancl_typ]
+            heapq.heapify(self.heap)
+            self.n_cancelled = 0
+
+    def _discard_cancelled(self):
+        # Remove cancelled entries from top of heap.
+        while self.heap and self.heap[0][2] == cancl_typ:
+            heapq.heappop(self.heap)
+            self.n_cancelled -= 1
 
     def check(self):
         #Check whether timers have triggered.
         global current_time, check_timers
-        self.available = bool(self.active_timers) and (self.active_timers[-1][0] <= current_time)
+        self._discard_cancelled()
+        self.available = bool(self.heap) and (self.heap[0][0] <= current_time)
         check_timers = False
 
     def get(self):
-        # Get first timer event.
+        # Get first timer event, returns None if the timers that had elapsed when check()
+        # was called have since been cancelled.
         global current_time
-        event_tuple = self.active_timers.pop()
-        self.available = bool(self.active_timers) and (self.active_timers[-1][0] <= current_time)
-        return event_tuple
+        self._discard_cancelled()
+        if not (self.heap and self.heap[0][0] <= current_time):
+            self.available = False
+            return None
+        entry = heapq.heappop(self.heap)
+        if entry[2] in (event_typ, timer_typ):
+            self.ID_index[entry[3]].remove(entry)
+        elif entry[2] == state_typ:
+            self.state_timers.remove(entry)
+        self._discard_cancelled()
+        self.available = bool(self.heap) and (self.heap[0][0] <= current_time)
+        return (entry[0], entry[2], entry[3])
 
     def disarm(self, event_ID):
         # Remove all user timers with specified event_ID.
-        self.active_timers = [t for t in self.active_timers 
-                              if not (t[2] == event_ID and (t[1] in (event_typ, timer_typ)))]
-        self.paused_timers = [t for t in self.paused_timers if not t[2] == event_ID]
+        if event_ID in self.ID_index:
+            for entry in self.ID_index.pop(event_ID):
+                self._cancel(entry)
+        if event_ID in self.paused_timers:
+            del self.paused_timers[event_ID]
 
     def pause(self, event_ID):
         # Pause all user timers with specified event_ID.
         global current_time
-        self.paused_timers += [(t[0]-current_time,t[1], t[2]) for t in self.active_timers 
-                               if (t[2] == event_ID and (t[1] in (event_typ, timer_typ)))]
-        self.active_timers = [t for t in self.active_timers 
-                              if not (t[2] == event_ID and (t[1] in (event_typ, timer_typ)))]
+        if event_ID in self.ID_index:
+            paused = self.paused_timers.setdefault(event_ID, [])
+            for entry in self.ID_index.pop(event_ID):
+                paused.append((entry[0]-current_time, entry[2]))
+                self._cancel(entry)
 
     def unpause(self, event_ID):
         # Unpause user timers with specified event.
         global current_time
-        self.active_timers += [(t[0]+current_time,t[1], t[2]) for t in self.paused_timers if t[2] == event_ID]
-        self.paused_timers = [t for t in self.paused_timers if not t[2] == event_ID]
-        self.active_timers.sort(reverse=True)
+        if event_ID in self.paused_timers:
+            for time_remaining, event_type in self.paused_timers.pop(event_ID):
+                self._push(time_remaining+current_time, event_type, event_ID)
 
     def remaining(self,event_ID):
         # Return time until timer for specified event elapses, returns 0 if no timer set for event.
         global current_time
-        try:
-            return next(t[0]-current_time for t in reversed(self.active_timers) 
-                        if (t[1] == event_typ and t[2] == event_ID))
-        except StopIteration:
-            return 0
+        trigger_time = None
+        for entry in self.ID_index.get(event_ID, ()):
+            if entry[2] == event_typ and (trigger_time is None or entry[0] < trigger_time):
+                trigger_time = entry[0]
+        return 0 if trigger_time is None else trigger_time-current_time
 
     def disarm_type(self, event_type):
         # Disarm all active timers of a particular type.
-        self.active_timers = [t for t in self.active_timers if not t[1] == event_type]
+        if event_type == state_typ:
+            for entry in self.state_timers:
+                self._cancel(entry)
+            self.state_timers = []
+        else:
+            for entry in self.heap:
+                if entry[2] == event_type:
+                    self._cancel(entry)
+            if event_type in (event_typ, timer_typ):
+                for event_ID, entries in list(self.ID_index.items()):
+                    self.ID_index[event_ID] = [e for e in entries if e[2] != cancl_typ]
 
 # Framework variables and objects ---------------------------------------------
 
@@ -120,12 +293,32 @@ state_machine = None  # State machine object.
 
 timer = Timer()  # Instantiate timer_array object.
 
-event_queue = Event_queue() # Instantiate event que object.
+event_queue = Event_queue(timing=True) # Instantiate event que object.
 
-data_output_queue = Event_queue() # Queue used for outputing events to serial line.
+data_output_queue = Event_queue(buffer_length=250, timing=True, name='data output queue') # Queue used for outputing events to serial line.
 
 data_output = True  # Whether to output data to the serial line.
 
+batch_output = False # Whether to send multiple data records to the serial line in a single frame.
+
+batch_size = 256 # Number of bytes in output batch at which batch is sent to computer.
+
+batch_age = 10 # Maximum time data is held in output batch before being sent to computer (ms).
+
+output_buffer = bytearray(512) # Buffer into which data records are written before sending.
+
+output_buffer_mv = memoryview(output_buffer)
+
+output_start = 3 # Index in output buffer of first data record, 8 if batching output to leave space for batch header.
+
+frame_seq = 0 # Sequence number of next frame sent to computer (modulo 256).
+
+ping_buffer = bytearray(12) # Buffer for clock sync echo frames sent in response to pings from computer.
+
+output_n_bytes = 0 # Number of bytes in output buffer.
+
+output_buffer_time = 0 # Time at which first record was written to output batch.
+
 current_time = None # Time since run started (milliseconds).
 
 running = False     # Set to True when framework is running, set to False to stop run.
@@ -142,6 +335,77 @@ clock = pyb.Timer(1) # Timer which generates clock tick.
 
 check_timers = False # Flag to say timers need to be checked, set True by clock tick.
 
+tickless = False # If True current time is read from millisecond counter each update rather than set by clock tick.
+
+instrument = False # Set True to record event latency, queue wait and event handler execution time histograms.
+
+high_res = False # Set True to output microsecond resolution timestamps for hardware events and analog data.
+
+record_micros = False # True if pyb.micros() times of interrupts are recorded, set at run start.
+
+anchor_us = 0 # pyb.micros() time corresponding to run time anchor_ms, used to convert micros to run time.
+
+anchor_ms = 0 # Run time (ms) corresponding to pyb.micros() time anchor_us.
+
+latency_hist = Histogram() # Time from interrupt to state machine event handler being called (us).
+
+queue_wait_hist = Histogram() # Time events wait in event queue before being processed (us).
+
+handler_hist = Histogram() # Execution time of state machine event processing (us).
+
+fast_dispatch = False # Set True to dispatch events to state machine by ID using handlers cached for current state.
+
+profile = False # Set True to record main loop execution time for each update priority level.
+
+loop_branches = ('idle', 'interrupts', 'check_timers', 'events', 'timers', 'serial_input',
+                 'streaming', 'data_output', 'output_batch', 'gc_collect') # Names of priority levels.
+
+loop_n  = array('i', [0]*len(loop_branches)) # Number of updates at each priority level (modulo 1e6).
+
+loop_mega_n = array('i', [0]*len(loop_branches)) # Number of updates at each priority level (millions).
+
+loop_us = array('i', [0]*len(loop_branches)) # Time spent at each priority level (us modulo 1e6).
+
+loop_s  = array('i', [0]*len(loop_branches)) # Time spent at each priority level (seconds).
+
+loop_max_us = 0 # Maximum execution time of single update (us).
+
+run_ms = 0 # Duration of last run (ms).
+
+drain_limit = 1 # Maximum items processed per priority level per update pass, if 1 one item is processed per update.
+
+drain_budget_us = 1000 # Time after which an update pass ends if drain_limit > 1 (us), 0 for no limit.
+
+starved = array('i', [0]*len(loop_branches)) # Number of update passes in which each priority level was left with work pending, at drain_limit or skipped by drain_budget_us.
+
+gc_schedule = False # Set True to disable automatic garbage collection during run and collect when framework is idle.
+
+gc_margin = 5 # Scheduled garbage collections are not performed if a timer is due within gc_margin ms, unless the longest pause so far fits before it.
+
+gc_check_interval = 10 # Interval at which heap usage is checked if gc_schedule is True (ms).
+
+gc_alloc_step = 8192 # Heap allocated since last collection (bytes) at which a scheduled collection becomes pending.
+
+gc_min_free = 4096 # Free heap (bytes) below which a collection is performed immediately, even if framework is busy.
+
+gc_pending = False # True if a scheduled garbage collection is waiting for idle time.
+
+gc_check_ms = -1 # Time heap usage was last checked (ms).
+
+gc_alloc_base = 0 # Heap allocated after last garbage collection (bytes).
+
+gc_forced = 0 # Number of garbage collections forced by free heap falling below gc_min_free.
+
+gc_starved = 0 # Number of forced garbage collections that occurred while a scheduled collection was pending.
+
+gc_max_us = 0 # Longest garbage collection pause (us), used to decide if a scheduled collection fits before the next timer.
+
+gc_pause_hist = Histogram(bin_width=100) # Garbage collection pause durations (us).
+
+heap_size = 0 # Total heap size (bytes).
+
+heap_min_free = 0 # Minimum free heap during run (bytes).
+
 start_time = 0 # Time at which framework run is started.
 
 # Framework functions ---------------------------------------------------------
@@ -152,6 +416,12 @@ def _clock_tick(timer):
     current_time = pyb.elapsed_millis(start_time)
     check_timers = True
 
+def interrupt_time():
+    # Return time since run started (ms) for timestamps taken in interrupt service routines.
+    # In tickless mode current_time is only updated between update passes, so the 
+    # millisecond counter is read instead.
+    return pyb.elapsed_millis(start_time) if tickless else current_time
+
 def register_machine(sm):
     global state_machine, states, events, ID2name
     # Adds state machine states and events to framework states and events dicts,
@@ -186,24 +456,152 @@ def get_variables():
     # Print first instantiated state machines variables as dict {v_name: repr(v_value)}
     print({k: repr(v) for k, v in state_machine.smd.v.__dict__.items()})
 
-def output_data(event):
-    # Output data to computer.
-    if event[1] in  (event_typ, state_typ): # send event or state change.
-        timestamp = event[0].to_bytes(4, 'little') 
-        ID        = event[2].to_bytes(2, 'little')
-        checksum  = sum(timestamp + ID).to_bytes(2, 'little') 
-        usb_serial.send(b'D' + timestamp + ID + checksum)
-    elif event[1] in (print_typ, varbl_typ): # send user generated output string.
-        if event[1] == print_typ: # send user generated output string.
-            start_byte = b'P'
-            data_bytes = event[2].encode()
-        elif event[1] == varbl_typ: # Variable changed.
-            start_byte = b'V'
-            data_bytes = event[2][0].encode() + b' ' + event[2][1].encode()
-        data_len = len(data_bytes).to_bytes(2, 'little')  
-        timestamp = event[0].to_bytes(4, 'little')
-        checksum  = (sum(data_len + timestamp) + sum(data_bytes)).to_bytes(2, 'little')
-        usb_serial.send(start_byte + data_len + timestamp + checksum + data_bytes)
+def describe():
+    # Print all information about state machine needed by the computer in a single call.  
+    # First line is 'D <describe_version>', followed by one line per item with tab 
+    # separated fields: 'S name ID' for states, 'E name ID' for events, 'A name ID Fs' 
+    # for analog inputs and 'V name repr(value)' for variables.
+    print('D', describe_version)
+    for name, ID in states.items():
+        print('S\t{}\t{}'.format(name, ID))
+    for name, ID in events.items():
+        print('E\t{}\t{}'.format(name, ID))
+    for io in hw.IO_dict.values():
+        if isinstance(io, hw.Analog_input):
+            print('A\t{}\t{}\t{}'.format(io.name, io.ID, io.sampling_rate))
+    for k, v in state_machine.smd.v.__dict__.items():
+        print('V\t{}\t{}'.format(k, repr(v)))
+
+def get_latency_stats():
+    # Print latency histograms from last run as dict.
+    print({'event_latency': latency_hist.get(), 'queue_wait': queue_wait_hist.get(), 
+           'handler_time': handler_hist.get()})
+
+def output_ping_echo(ping_ID):
+    # Send clock sync echo frame to computer in response to ping.  Frame format: 'T i t k'
+    # where i is ping ID (2 bytes), t time since run started (ms) (4 bytes) and k checksum
+    # (2 bytes).  The echo is sent immediately, ahead of any batched output, so the 
+    # computer can estimate board clock offset and drift from the round trip.
+    struct.pack_into('<BHI', ping_buffer, 3, 84, ping_ID, pyb.elapsed_millis(start_time)) # 84 = ord('T')
+    struct.pack_into('<H', ping_buffer, 10, sum(ping_buffer[4:10]))
+    write_frame_header(ping_buffer, 0)
+    usb_serial.send(ping_buffer)
+
+def output_latency_stats():
+    # Send latency histograms to computer.  Frame format: 'L l t k H' where l is length
+    # of histogram data (2 bytes), t timestamp (4 bytes), k checksum (2 bytes) and H the
+    # event latency, queue wait and handler time histograms (see Histogram.to_bytes).
+    _send_output()
+    data_bytes = latency_hist.to_bytes() + queue_wait_hist.to_bytes() + handler_hist.to_bytes()
+    header = len(data_bytes).to_bytes(2, 'little') + current_time.to_bytes(4, 'little')
+    checksum = (sum(header) + sum(data_bytes)) & 0xFFFF
+    frame_header = bytearray(3)
+    write_frame_header(frame_header, 0)
+    usb_serial.send(frame_header + b'L' + header + checksum.to_bytes(2, 'little'))
+    usb_serial.send(data_bytes)
+
+def get_queue_stats():
+    # Print usage statistics for event and data output queues from last run as dict.
+    print({'event_queue': event_queue.stats(), 'data_output_queue': data_output_queue.stats()})
+
+def micros_to_run_time(t_us):
+    # Convert pyb.micros() time to run time, returned as milliseconds and microseconds
+    # remainder.  The pyb.micros() counter wraps every 2**30 us, so t_us must be within
+    # ~9 minutes of anchor_us, which is advanced every minute by an anchor update timer.
+    d = (t_us - anchor_us) & 0x3FFFFFFF
+    if d >= 0x20000000: # t_us is before anchor.
+        d -= 0x40000000
+    return anchor_ms + d // 1000, d % 1000
+
+def _advance_anchor():
+    # Move micros to run time conversion anchor forward by one minute.
+    global anchor_us, anchor_ms
+    anchor_us = (anchor_us + 60000000) & 0x3FFFFFFF
+    anchor_ms += 60000
+    timer.set(60000 - (current_time - anchor_ms), anchr_typ, None)
+
+def write_frame_header(buf, i):
+    # Write frame header 'Y s n' to buf at index i and increment frame sequence number. 
+    # Every frame sent to the computer starts with a frame header, where Y is the sync byte
+    # 0xA5, s the frame sequence number modulo 256 and n its bitwise inverse.  The header
+    # allows the computer to detect dropped frames and resynchronise after corrupted data.
+    global frame_seq
+    buf[i] = 0xA5
+    buf[i+1] = frame_seq
+    buf[i+2] = frame_seq ^ 0xFF
+    frame_seq = (frame_seq + 1) & 0xFF
+
+def output_data(event_time, event_type, event_data, origin_us=-1):
+    # Write data record to output buffer.  If batch_output is False the record is sent to 
+    # the computer immediately, otherwise records are accumulated in the output buffer and
+    # sent as a single batch frame once batch_size bytes are buffered or batch_age elapses.
+    # Data record formats:
+    # Event or state entry: 'D t i k', print or variable: 'P l t k s' or 'V l t k s' where:
+    # t timestamp (ms) (4 bytes), i event or state ID (2 bytes), l length of string (2 bytes)
+    # k checksum (2 bytes), s string bytes (variable).  The string of a V record contains
+    # one 'v_name v_str' line per variable, preceded by a '# request_ID' line if the record
+    # is the response to a get variables request.  If high_res is True, events generated
+    # by interrupts are output as 'd t i u k' where u is microseconds past t (2 bytes).
+    # Batch frame format: 'M l k R' where l is length of records (2 bytes), k checksum (2 bytes)
+    # and R the concatenated data records.  Each record or batch is sent as a frame preceded
+    # by a frame header (see write_frame_header).
+    global output_n_bytes, output_buffer_time
+    if high_res and origin_us >= 0: # send event with microsecond timestamp.
+        if output_n_bytes + 11 > len(output_buffer):
+            _send_output()
+        i = output_n_bytes
+        event_ms, event_us = micros_to_run_time(origin_us)
+        struct.pack_into('<BIHH', output_buffer, i, 100, event_ms, event_data, event_us) # 100 = ord('d')
+        struct.pack_into('<H', output_buffer, i+9, sum(output_buffer_mv[i+1:i+9]))
+        n_bytes = 11
+    elif event_type in  (event_typ, state_typ): # send event or state change.
+        if output_n_bytes + 9 > len(output_buffer):
+            _send_output()
+        i = output_n_bytes
+        struct.pack_into('<BIH', output_buffer, i, 68, event_time, event_data) # 68 = ord('D')
+        struct.pack_into('<H', output_buffer, i+7, sum(output_buffer_mv[i+1:i+7]))
+        n_bytes = 9
+    elif event_type in (print_typ, varbl_typ): # send user generated output string.
+        if event_type == print_typ: # send user generated output string.
+            start_byte = 80 # ord('P')
+            data_bytes = event_data.encode()
+        elif event_type == varbl_typ: # Variables changed.
+            start_byte = 86 # ord('V')
+            data_bytes = '\n'.join([v_name + ' ' + v_str for v_name, v_str in event_data]).encode()
+        n_bytes = 9 + len(data_bytes)
+        if output_n_bytes + n_bytes > len(output_buffer):
+            _send_output()
+        i = output_n_bytes
+        struct.pack_into('<BHI', output_buffer, i, start_byte, len(data_bytes), event_time)
+        checksum = sum(output_buffer_mv[i+1:i+7]) + sum(data_bytes)
+        struct.pack_into('<H', output_buffer, i+7, checksum & 0xFFFF)
+        if i + n_bytes > len(output_buffer): # Record too large for buffer, send directly.
+            write_frame_header(output_buffer, i-3)
+            usb_serial.send(output_buffer_mv[i-3:i+9])
+            usb_serial.send(data_bytes)
+            return
+        output_buffer_mv[i+9:i+n_bytes] = data_bytes
+    else:
+        return
+    if output_n_bytes == output_start:
+        output_buffer_time = current_time
+    output_n_bytes += n_bytes
+    if not batch_output or output_n_bytes >= batch_size:
+        _send_output()
+
+def _send_output():
+    # Send data records in output buffer to computer, adding frame header, and batch
+    # header if batching output.
+    global output_n_bytes
+    if output_n_bytes == output_start:
+        return # No data to send.
+    if batch_output:
+        struct.pack_into('<BH', output_buffer, 3, 77, output_n_bytes-8) # 77 = ord('M')
+        checksum = sum(output_buffer_mv[4:6]) + sum(output_buffer_mv[8:output_n_bytes])
+        struct.pack_into('<H', output_buffer, 6, checksum & 0xFFFF)
+    write_frame_header(output_buffer, 0)
+    usb_serial.send(output_buffer_mv[:output_n_bytes])
+    output_n_bytes = output_start
 
 def recieve_data():
     # Read and process data from computer.
@@ -211,84 +609,385 @@ def recieve_data():
     new_byte = usb_serial.read(1) 
     if new_byte == b'\x03': # Serial command to stop run.
         running = False
+    elif new_byte == b'L': # Get latency stats command.
+        output_latency_stats()
+    elif new_byte == b'T': # Clock sync ping.
+        output_ping_echo(int.from_bytes(usb_serial.read(2), 'little'))
     elif new_byte == b'V': # Get/set variables command.
         data_len = int.from_bytes(usb_serial.read(2), 'little')
         data = usb_serial.read(data_len)
         checksum = int.from_bytes(usb_serial.read(2), 'little')
         if not checksum == (sum(data) & 0xFFFF):
             return  # Bad checksum.
-        if data[-1:] == b's': # Set variable.
-            v_name, v_str = eval(data[:-1])
-            if state_machine._set_variable(v_name, v_str):
-                data_output_queue.put((current_time, varbl_typ, (v_name, v_str)))
-        elif data[-1:] == b'g': # Get variable.
-            v_name = data[:-1].decode()
-            v_str = str(state_machine._get_variable(v_name))
-            data_output_queue.put((current_time, varbl_typ, (v_name, v_str)))
+        if data[-1:] == b'S': # Set variables.
+            v_strs = state_machine._set_variables(decode_variables(data[:-1]))
+        elif data[-1:] == b'G': # Get variables, response starts with '# request_ID' line.
+            v_strs = [('#', str(int.from_bytes(data[:2], 'little')))] + [
+                (v_name, repr(state_machine._get_variable(v_name)))
+                for v_name, _, _ in decode_variables(data[2:-1])]
+        else:
+            return
+        if v_strs:
+            data_output_queue.put(current_time, varbl_typ, v_strs)
+
+def decode_variables(data):
+    # Decode variables sent by computer, returns list of (v_name, value, evaluate).  Each
+    # variable is encoded as 'n N t x' where n is length of name (1 byte), N name bytes,
+    # t type code (1 byte) and x the value.  Type codes: 'i' int (4 bytes), 'f' float 
+    # (4 bytes), 'T' True, 'F' False, 'N' None (no value bytes), 's' string (2 byte length 
+    # + string bytes), 'r' repr of other type evaluated on the board (2 byte length + 
+    # string bytes), '-' no value, used to request variable values.
+    v_values = []
+    i = 0
+    while i < len(data):
+        j = i + 1 + data[i] # Index of type code.
+        v_name = bytes(data[i+1:j]).decode()
+        type_code = data[j]
+        i = j + 1
+        evaluate = False
+        if type_code == 105: # ord('i')
+            value = struct.unpack_from('<i', data, i)[0]
+            i += 4
+        elif type_code == 102: # ord('f')
+            value = struct.unpack_from('<f', data, i)[0]
+            i += 4
+        elif type_code in (115, 114): # ord('s'), ord('r')
+            str_len = struct.unpack_from('<H', data, i)[0]
+            value = bytes(data[i+2:i+2+str_len]).decode()
+            evaluate = type_code == 114
+            i += 2 + str_len
+        else:
+            value = {84: True, 70: False}.get(type_code) # ord('T'), ord('F'), None otherwise.
+        v_values.append((v_name, value, evaluate))
+    return v_values
+
+def set_variables(data, checksum):
+    # Set variables from data encoded by decode_variables, print True if all variables set OK.
+    if not (sum(data) & 0xFFFF) == checksum:
+        print(False) # Bad checksum.
+        return
+    v_values = decode_variables(data)
+    print(len(state_machine._set_variables(v_values)) == len(v_values))
 
 def _update():
-    # Perform framework update functions in order of priority.
-    global running
+    # Perform framework update functions in order of priority.  Returns the priority 
+    # level of the update function performed, or 0 if there was nothing to do.
+    global current_time, check_timers
+
+    if tickless: # Update current time, check timers only if next timer has elapsed.
+        current_time = pyb.elapsed_millis(start_time)
+        if timer.heap and not timer.available and timer.heap[0][0] <= current_time:
+            check_timers = True
+
+    if gc_schedule and current_time - gc_check_ms >= gc_check_interval: # Check heap usage.
+        _gc_check()
 
     if hw.interrupt_queue.available: # Priority 1: Process hardware interrupts.
         hw.IO_dict[hw.interrupt_queue.get()]._process_interrupt()
+        return 1
 
     elif check_timers: # Priority 2: Check for elapsed timers.
         timer.check()
+        return 2
 
     elif event_queue.available: # Priority 3: Process event from queue.
-        event = event_queue.get()
-        data_output_queue.put(event)
-        state_machine._process_event(ID2name[event[2]])
+        _process_queued_event()
+        return 3
 
     elif timer.available: # Priority 4: Process timer event.
-        event = timer.get()
-        if  event[1] == timer_typ:
-            state_machine._process_event(ID2name[event[2]])
-        elif event[1] == event_typ:
-            data_output_queue.put(event)
-            state_machine._process_event(ID2name[event[2]])
-        elif event[1] == hardw_typ:
-            hw.IO_dict[event[2]]._timer_callback()
-        elif event[1] == state_typ:
-            state_machine.goto_state(ID2name[event[2]])
-        elif event[1] == stopf_typ:
-            running = False
+        _process_timer_event()
+        return 4
 
     elif usb_serial.any(): # Priority 5: Check for serial input from computer.
         recieve_data()
+        return 5
 
     elif hw.stream_data_queue.available: # Priority 6: Stream analog data.
         hw.IO_dict[hw.stream_data_queue.get()]._process_streaming()
+        return 6
 
     elif data_output_queue.available: # Priority 7: Output framework data.
-        output_data(data_output_queue.get())
-
-def run(duration = None):
-    # Run framework for specified number of seconds.
+        _output_queued_data()
+        return 7
+
+    elif (batch_output and output_n_bytes > output_start and # Priority 8: Send output batch once batch_age elapsed.
+          current_time - output_buffer_time >= batch_age):
+        _send_output()
+        return 8
+
+    elif gc_pending and _gc_due(): # Priority 9: Scheduled garbage collection.
+        _gc_collect()
+        return 9
+
+    return 0
+
+def _process_queued_event():
+    # Get event from event queue, output it and pass it to the state machine.
+    event_queue.get()
+    data_output_queue.put(event_queue.timestamp, event_typ, event_queue.event_data, event_queue.origin_us)
+    if instrument:
+        _timed_process_event(event_queue.event_data, event_queue.put_us, event_queue.origin_us)
+    elif fast_dispatch:
+        state_machine._process_event_ID(event_queue.event_data)
+    else:
+        state_machine._process_event(ID2name[event_queue.event_data])
+
+def _process_timer_event():
+    # Get elapsed timer event and process it.
+    global running
+    event = timer.get()
+    if event is None: # Elapsed timer was cancelled.
+        return
+    if event[1] in (timer_typ, event_typ):
+        if event[1] == event_typ:
+            data_output_queue.put(*event)
+        if instrument:
+            _timed_process_event(event[2])
+        elif fast_dispatch:
+            state_machine._process_event_ID(event[2])
+        else:
+            state_machine._process_event(ID2name[event[2]])
+    elif event[1] == hardw_typ:
+        hw.IO_dict[event[2]]._timer_callback()
+    elif event[1] == state_typ:
+        state_machine.goto_state(ID2name[event[2]])
+    elif event[1] == stopf_typ:
+        running = False
+    elif event[1] == anchr_typ:
+        _advance_anchor()
+
+def _output_queued_data():
+    # Get data from data output queue and output it.
+    data_output_queue.get()
+    output_data(data_output_queue.timestamp, data_output_queue.event_type, 
+                data_output_queue.event_data, data_output_queue.origin_us)
+
+def _gc_check():
+    # Read heap usage, called every gc_check_interval ms if gc_schedule is True.  If free
+    # heap is below gc_min_free a collection is performed immediately, otherwise if heap 
+    # allocated since the last collection exceeds gc_alloc_step a collection is scheduled.
+    global gc_check_ms, gc_pending, gc_forced, gc_starved, heap_min_free
+    gc_check_ms = current_time
+    free = gc.mem_free()
+    if free < heap_min_free:
+        heap_min_free = free
+    if free < gc_min_free:
+        gc_forced += 1
+        if gc_pending: # Scheduled collection did not find time to run.
+            gc_starved += 1
+        _gc_collect()
+    elif heap_size - free - gc_alloc_base >= gc_alloc_step:
+        gc_pending = True
+
+def _gc_due():
+    # Return True if a scheduled collection is pending and no timer is due within gc_margin,
+    # or the longest collection pause so far fits before the next timer is due.
+    if not (gc_pending and timer.heap):
+        return gc_pending
+    ms_to_timer = timer.heap[0][0] - current_time
+    return ms_to_timer >= gc_margin or 1000*(ms_to_timer-1) > gc_max_us
+
+def _gc_collect():
+    # Perform garbage collection and record its duration.
+    global gc_pending, gc_alloc_base, gc_max_us
+    t0 = pyb.micros()
+    gc.collect()
+    dt = pyb.elapsed_micros(t0)
+    gc_pause_hist.add(dt)
+    if dt > gc_max_us:
+        gc_max_us = dt
+    gc_pending = False
+    gc_alloc_base = gc.mem_alloc()
+
+def get_gc_stats():
+    # Print garbage collection and heap usage statistics from last run as dict.
+    print({'collections': sum(gc_pause_hist.counts), 'forced': gc_forced, 'starved': gc_starved,
+           'pause_us': gc_pause_hist.get(), 'heap_size': heap_size, 'heap_min_free': heap_min_free})
+
+def _output_batch_due():
+    # Return True if the output batch contains data and batch_age has elapsed.
+    return (batch_output and output_n_bytes > output_start and
+            current_time - output_buffer_time >= batch_age)
+
+# Update priority levels as (work_pending, do_work) function pairs, used by _drain_update.
+update_levels = ((lambda: hw.interrupt_queue.available, 
+                  lambda: hw.IO_dict[hw.interrupt_queue.get()]._process_interrupt()),
+                 (lambda: check_timers, lambda: timer.check()),
+                 (lambda: event_queue.available, _process_queued_event),
+                 (lambda: timer.available, _process_timer_event),
+                 (lambda: usb_serial.any(), recieve_data),
+                 (lambda: hw.stream_data_queue.available,
+                  lambda: hw.IO_dict[hw.stream_data_queue.get()]._process_streaming()),
+                 (lambda: data_output_queue.available, _output_queued_data),
+                 (_output_batch_due, _send_output),
+                 (_gc_due, _gc_collect))
+
+def _work_pending_above(level):
+    # Return True if any update level with higher priority than level has work pending.
+    for i in range(level):
+        if update_levels[i][0]():
+            return True
+    return False
+
+def _drain_update():
+    # Perform one pass over the update priority levels in order of priority, doing up to
+    # drain_limit items of work at each level.  Scheduled garbage collection is skipped if
+    # any higher priority level still has work pending, so collections are only performed
+    # when the framework is idle.  If drain_budget_us has elapsed after a level is
+    # processed the pass ends.  A level's starvation count is incremented if it stops at
+    # drain_limit with work still pending, or is skipped with work pending because the
+    # budget elapsed.
+    global current_time, check_timers
+    if tickless:
+        current_time = pyb.elapsed_millis(start_time)
+        if timer.heap and not timer.available and timer.heap[0][0] <= current_time:
+            check_timers = True
+    if gc_schedule and current_time - gc_check_ms >= gc_check_interval:
+        _gc_check()
+    t0 = pyb.micros()
+    for i in range(len(update_levels)):
+        work_pending, do_work = update_levels[i]
+        if do_work is _gc_collect and gc_pending and _work_pending_above(i):
+            continue
+        n = 0
+        while work_pending():
+            if n == drain_limit: # Level held back with work pending.
+                starved[i+1] += 1
+                break
+            do_work()
+            n += 1
+        if drain_budget_us and pyb.elapsed_micros(t0) > drain_budget_us:
+            for j in range(i+1, len(update_levels)): # Levels skipped with work pending.
+                if update_levels[j][0]():
+                    starved[j+1] += 1
+            break
+
+def _profile_update():
+    # Call _update and record its execution time for the priority level performed.
+    global loop_max_us
+    t0 = pyb.micros()
+    i = _update()
+    dt = pyb.elapsed_micros(t0)
+    loop_us[i] += dt
+    if loop_us[i] >= 1000000:
+        loop_us[i] -= 1000000
+        loop_s[i] += 1
+    loop_n[i] += 1
+    if loop_n[i] >= 1000000:
+        loop_n[i] -= 1000000
+        loop_mega_n[i] += 1
+    if dt > loop_max_us:
+        loop_max_us = dt
+
+def get_loop_stats():
+    # Print main loop profiling statistics and starvation counts from last run as dict.
+    run_us = 1000*run_ms if run_ms else 1
+    stats = {'run_ms': run_ms, 'max_iteration_us': loop_max_us,
+             'idle_fraction': (1000000*loop_s[0]+loop_us[0])/run_us}
+    for i, name in enumerate(loop_branches):
+        total_us = 1000000*loop_s[i] + loop_us[i]
+        n = 1000000*loop_mega_n[i] + loop_n[i]
+        stats[name] = {'count': n, 'total_us': total_us, 'fraction': total_us/run_us,
+                       'mean_us': total_us/n if n else 0, 'starved': starved[i]}
+    print(stats)
+
+def _timed_process_event(event_ID, put_us=-1, origin_us=-1):
+    # Process event, recording event latency, queue wait and handler execution times.
+    t0 = pyb.micros()
+    if origin_us >= 0:
+        latency_hist.add(pyb.elapsed_micros(origin_us))
+    if put_us >= 0:
+        queue_wait_hist.add(pyb.elapsed_micros(put_us))
+    if fast_dispatch:
+        state_machine._process_event_ID(event_ID)
+    else:
+        state_machine._process_event(ID2name[event_ID])
+    handler_hist.add(pyb.elapsed_micros(t0))
+
+def run(duration=None, tickless_mode=False):
+    # Run framework for specified number of seconds.  If tickless_mode is True the 1kHz
+    # clock tick is not used, instead current time is read from the pyboards millisecond
+    # counter on each update and timers are checked only when the next timer has elapsed.
+    # This removes the clock tick interrupt overhead and timers are processed as soon as
+    # the update loop sees the millisecond counter reach their trigger time rather than
+    # at the next clock tick.  Tickless mode polls the counter, there is no one-shot timer
+    # interrupt to wake the framework, so timer resolution remains 1ms and how promptly
+    # timers are processed depends on how long update passes take.  Timestamps taken in
+    # interrupt service routines read the counter, see interrupt_time.
+    # If drain_limit > 1 updates are performed by _drain_update, otherwise by _update,
+    # main loop profiling is only available for _update.  If gc_schedule is True automatic
+    # garbage collection is disabled during the run and collections are performed when the
+    # framework is idle and the collection is expected to finish before the next timer is
+    # due, or immediately if free heap runs low.
     # Pre run
-    global current_time, start_time, running
+    global current_time, start_time, running, output_start, output_n_bytes, tickless, loop_max_us, run_ms
+    global frame_seq
+    global record_micros, anchor_us, anchor_ms
+    global gc_pending, gc_check_ms, gc_alloc_base, gc_forced, gc_starved, gc_max_us
+    global heap_size, heap_min_free
     timer.reset()
     event_queue.reset()
     data_output_queue.reset()
+    latency_hist.reset()
+    queue_wait_hist.reset()
+    handler_hist.reset()
+    for i in range(len(loop_branches)):
+        loop_n[i] = loop_mega_n[i] = loop_us[i] = loop_s[i] = starved[i] = 0
+    loop_max_us = 0
+    output_start = 8 if batch_output else 3
+    output_n_bytes = output_start
+    frame_seq = 0
     if not hw.initialised: hw.initialise()
+    gc_pause_hist.reset()
+    gc_pending = False
+    gc_check_ms = -gc_check_interval
+    gc_forced = gc_starved = 0
+    t0 = pyb.micros()
+    gc.collect()
+    gc_max_us = pyb.elapsed_micros(t0) # Initial estimate of collection pause.
+    gc_alloc_base = gc.mem_alloc()
+    heap_size = gc_alloc_base + gc.mem_free()
+    heap_min_free = heap_size - gc_alloc_base
+    if gc_schedule:
+        gc.disable()
+    else:
+        gc.enable()
     current_time = 0
+    record_micros = instrument or high_res
     hw.run_start()
     start_time = pyb.millis()
-    clock.init(freq=1000)
-    clock.callback(_clock_tick)
+    anchor_us = pyb.micros()
+    anchor_ms = 0
+    tickless = tickless_mode
+    if not tickless:
+        clock.init(freq=1000)
+        clock.callback(_clock_tick)
     usb_serial.setinterrupt(-1) # Disable 'ctrl+c' on serial raising KeyboardInterrupt.
     running = True
     state_machine._start()
     if duration: # Set timer to stop framework.
-        timer.set(duration*1000, (stopf_typ, None))
+        timer.set(duration*1000, stopf_typ, None)
+    if high_res: # Set timer to advance micros to run time conversion anchor.
+        timer.set(60000, anchr_typ, None)
     # Run
-    while running:
-        _update()
+    if drain_limit > 1:
+        while running:
+            _drain_update()
+    elif profile:
+        while running:
+            _profile_update()
+    else:
+        while running:
+            _update()
+    run_ms = pyb.elapsed_millis(start_time)
     # Post run
     usb_serial.setinterrupt(3) # Enable 'ctrl+c' on serial raising KeyboardInterrupt.
+    gc.enable()
     clock.deinit()
     hw.run_stop()
     state_machine._stop()
     while data_output_queue.available:
-        output_data(data_output_queue.get())
\ No newline at end of file
+        _output_queued_data()
+    if instrument:
+        output_latency_stats()
+    _send_output()
\ No newline at end of file
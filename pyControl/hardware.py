@@ -190,7 +190,9 @@ class Digital_input(IO_object):
             self.decimate_counter = (self.decimate_counter+1) % self.decimate
             if not self.decimate_counter == 0:
                 return # Ignore input due to decimation.
-        self.interrupt_timestamp = fw.current_time
+        self.interrupt_timestamp = fw.interrupt_time()
+        if fw.record_micros:
+            self.interrupt_us = pyb.micros()
         if self.debounce: # Digital input uses debouncing.
             self.debounce_active = True
             self.pin_state = not self.pin_state
@@ -200,7 +202,7 @@ class Digital_input(IO_object):
 
     def _process_interrupt(self):
         # Put apropriate event for interrupt in event queue.
-        self._publish_if_edge_has_event(self.interrupt_timestamp)
+        self._publish_if_edge_has_event(self.interrupt_timestamp, self.interrupt_us)
         if self.debounce: # Set timer to deactivate debounce in self.debounce milliseconds.
             fw.timer.set(self.debounce, fw.hardw_typ, self.ID)
 
@@ -212,12 +214,12 @@ class Digital_input(IO_object):
             self._publish_if_edge_has_event(fw.current_time)
         self.debounce_active = False
 
-    def _publish_if_edge_has_event(self, timestamp):
+    def _publish_if_edge_has_event(self, timestamp, origin_us=-1):
         # Publish event if detected edge has event ID assigned.
         if self.pin_state and self.rising_event_ID:          # Rising edge.
-            fw.event_queue.put((timestamp, fw.event_typ, self.rising_event_ID))
+            fw.event_queue.put(timestamp, fw.event_typ, self.rising_event_ID, origin_us)
         elif (not self.pin_state) and self.falling_event_ID: # Falling edge.
-            fw.event_queue.put((timestamp, fw.event_typ, self.falling_event_ID))
+            fw.event_queue.put(timestamp, fw.event_typ, self.falling_event_ID, origin_us)
 
     def value(self):
         # Return state of the input. 
@@ -228,6 +230,7 @@ class Digital_input(IO_object):
         if self.use_both_edges:
             self.pin_state = self.pin.value()
         self.interrupt_timestamp = 0
+        self.interrupt_us = -1
         self.decimate_counter = -1
 
 # Analog input ----------------------------------------------------------------
@@ -246,6 +249,9 @@ class Analog_input(IO_object):
     # t timestamp of chunk start (ms)(4 bytes)
     # k checksum (2 bytes)
     # D data array bytes (variable)
+    # If framework high_res is True the chunk format is 'a c i r l t u k D' where u is the
+    # microseconds past t of the chunk start (2 bytes).  Chunks are preceded by a frame 
+    # header (see framework.write_frame_header).
 
     def __init__(self, pin, name, sampling_rate, threshold=None, rising_event=None, 
                  falling_event=None, data_type='H'):
@@ -270,13 +276,16 @@ class Analog_input(IO_object):
         self.buffers = (array(data_type, [0]*self.buffer_size),array(data_type, [0]*self.buffer_size))
         self.buffers_mv = (memoryview(self.buffers[0]), memoryview(self.buffers[1]))
         self.buffer_start_times = array('i', [0,0])
-        self.data_header = array('B', b'A' + data_type.encode() + 
-            self.ID.to_bytes(2,'little') + sampling_rate.to_bytes(2,'little') + b'\x00'*8)
+        self.buffer_start_us = array('i', [0,0]) # pyb.micros() time of buffer starts, used if high_res.
+        self.data_header = array('B', b'\x00'*3 + b'A' + data_type.encode() + 
+            self.ID.to_bytes(2,'little') + sampling_rate.to_bytes(2,'little') + b'\x00'*10)
+        self.data_header_mv = memoryview(self.data_header)
         # Event generation variables
         self.threshold = threshold
         self.rising_event = rising_event
         self.falling_event = falling_event
         self.timestamp = 0
+        self.crossing_us = -1
         self.crossing_direction = False
 
     def _initialise(self):
@@ -310,6 +319,8 @@ class Analog_input(IO_object):
         if not self.recording:
             self.write_index = 0  # Buffer index to write new data to. 
             self.buffer_start_times[self.write_buffer] = fw.current_time
+            if fw.high_res:
+                self.buffer_start_us[self.write_buffer] = pyb.micros()
             self.recording = True
             if not self.acquiring: self._start_acquisition()
 
@@ -336,22 +347,26 @@ class Analog_input(IO_object):
                 self.above_threshold = new_above_threshold
                 if ((    self.above_threshold and self.rising_event_ID) or 
                     (not self.above_threshold and self.falling_event_ID)):
-                        self.timestamp = fw.current_time
+                        self.timestamp = fw.interrupt_time()
+                        if fw.record_micros:
+                            self.crossing_us = pyb.micros()
                         self.crossing_direction = self.above_threshold
                         interrupt_queue.put(self.ID)
         if self.recording:
             self.write_index = (self.write_index + 1) % self.buffer_size
             if self.write_index == 0: # Buffer full, switch buffers.
                 self.write_buffer = 1 - self.write_buffer
-                self.buffer_start_times[self.write_buffer] = fw.current_time
+                self.buffer_start_times[self.write_buffer] = fw.interrupt_time()
+                if fw.high_res:
+                    self.buffer_start_us[self.write_buffer] = pyb.micros()
                 stream_data_queue.put(self.ID)
 
     def _process_interrupt(self):
         # Put event generated by threshold crossing in event queue.
         if self.crossing_direction:
-            fw.event_queue.put((self.timestamp, fw.event_typ, self.rising_event_ID))
+            fw.event_queue.put(self.timestamp, fw.event_typ, self.rising_event_ID, self.crossing_us)
         else:
-            fw.event_queue.put((self.timestamp, fw.event_typ, self.falling_event_ID))
+            fw.event_queue.put(self.timestamp, fw.event_typ, self.falling_event_ID, self.crossing_us)
 
     def _process_streaming(self):
         # Stream full buffer to computer.
@@ -360,12 +375,23 @@ class Analog_input(IO_object):
     def _send_buffer(self, buffer_n, n_samples=False):
         # Send specified buffer to host computer.
         n_bytes = self.bytes_per_sample*n_samples if n_samples else self.bytes_per_sample*self.buffer_size
-        self.data_header[6:8]  = n_bytes.to_bytes(2,'little')
-        self.data_header[8:12] = self.buffer_start_times[buffer_n].to_bytes(4,'little')
+        self.data_header[9:11]  = n_bytes.to_bytes(2,'little')
         checksum = sum(self.buffers_mv[buffer_n][:n_samples] if n_samples else self.buffers[buffer_n])
-        checksum += sum(self.data_header[1:12])
-        self.data_header[12:14] = checksum.to_bytes(2,'little')
-        fw.usb_serial.write(self.data_header)
+        fw.write_frame_header(self.data_header, 0)
+        if fw.high_res: # Header includes microseconds of chunk start time.
+            start_ms, start_us = fw.micros_to_run_time(self.buffer_start_us[buffer_n])
+            self.data_header[3] = 97 # ord('a')
+            self.data_header[11:15] = start_ms.to_bytes(4,'little')
+            self.data_header[15:17] = start_us.to_bytes(2,'little')
+            checksum += sum(self.data_header[4:17])
+            self.data_header[17:19] = (checksum & 0xFFFF).to_bytes(2,'little')
+            fw.usb_serial.write(self.data_header_mv[:19])
+        else:
+            self.data_header[3] = 65 # ord('A')
+            self.data_header[11:15] = self.buffer_start_times[buffer_n].to_bytes(4,'little')
+            checksum += sum(self.data_header[4:15])
+            self.data_header[15:17] = checksum.to_bytes(2,'little')
+            fw.usb_serial.write(self.data_header_mv[:17])
         if n_samples: # Send first n_samples from buffer.
             fw.usb_serial.send(self.buffers_mv[buffer_n][:n_samples])
         else: # Send entire buffer.
@@ -510,6 +536,6 @@ class Rsync(IO_object):
             fw.timer.set(randint(self.min_IPI, self.max_IPI), fw.hardw_typ, self.ID)
         else: # Pin low -> high, set timer for pulse duration.
             fw.timer.set(self.pulse_dur, fw.hardw_typ, self.ID)
-            fw.data_output_queue.put((fw.current_time, fw.event_typ, self.event_ID))
+            fw.data_output_queue.put(fw.current_time, fw.event_typ, self.event_ID)
         self.state = not self.state
         self.sync_pin.value(self.state)
\ No newline at end of file
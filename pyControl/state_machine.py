@@ -21,6 +21,19 @@ class State_machine():
             else:
                 self.event_dispatch_dict[state] = None
 
+        # Make lists indexed by ID of state handler functions and event names, used for
+        # fast event dispatch.  The event name passed to handlers is the same string object 
+        # as in the task's event list so comparisons with event names work unchanged.
+        max_ID = max(list(fw.states.values()) + list(fw.events.values()))
+        self.ID2handler = [None] * (max_ID + 1) # Event handler function for each state ID.
+        self.ID2event = [None] * (max_ID + 1)   # Event name for each event ID.
+        for state, ID in fw.states.items():
+            self.ID2handler[ID] = self.event_dispatch_dict[state]
+        for event, ID in fw.events.items():
+            self.ID2event[ID] = event
+        self.all_states_handler = self.event_dispatch_dict['all_states']
+        self.current_handler = None # Event handler function for current state.
+
         # Attach user methods to discription object namespace, this allows the user
         # to write e.g. goto_state(state) in the task description to call 
         # State_machine.goto_state. 
@@ -51,8 +64,9 @@ class State_machine():
         self._process_event('exit')
         fw.timer.disarm_type(fw.state_typ) # Clear any timed_goto_states     
         if fw.data_output:
-            fw.data_output_queue.put((fw.current_time, fw.state_typ, fw.states[next_state]))
+            fw.data_output_queue.put(fw.current_time, fw.state_typ, fw.states[next_state])
         self.current_state = next_state
+        self.current_handler = self.ID2handler[fw.states[next_state]]
         self._process_event('entry')
         self.state_transition_in_progress = False
 
@@ -93,11 +107,11 @@ class State_machine():
         # Used to output data print_string with timestamp.  print_string is stored and only
         #  printed to serial line once higher priority tasks have all been processed. 
         if fw.data_output:
-            fw.data_output_queue.put((fw.current_time, fw.print_typ, str(print_string)))
+            fw.data_output_queue.put(fw.current_time, fw.print_typ, str(print_string))
 
     def publish_event(self, event):
         # Put event with specified name in the event queue.
-        fw.event_queue.put((fw.current_time, fw.event_typ, fw.events[event]))
+        fw.event_queue.put(fw.current_time, fw.event_typ, fw.events[event])
 
     def stop_framework(self):
         fw.running = False
@@ -115,13 +129,22 @@ class State_machine():
         if self.event_dispatch_dict[self.current_state]:                # If state machine has event handler function for current state.
             self.event_dispatch_dict[self.current_state](event)         # Evaluate state event handler function.
 
+    def _process_event_ID(self, event_ID):
+        # Process event given event ID using handler functions cached for current state.
+        event = self.ID2event[event_ID]
+        if self.all_states_handler:
+            if self.all_states_handler(event): return
+        if self.current_handler:
+            self.current_handler(event)
+
     def _start(self):
         # Called when run is started. Puts agent in initial state, and runs entry event.
         if self.event_dispatch_dict['run_start']:
             self.event_dispatch_dict['run_start']()
         self.current_state = self.smd.initial_state
+        self.current_handler = self.ID2handler[fw.states[self.current_state]]
         if fw.data_output:
-            fw.data_output_queue.put((fw.current_time, fw.state_typ, fw.states[self.current_state]))
+            fw.data_output_queue.put(fw.current_time, fw.state_typ, fw.states[self.current_state])
         self._process_event('entry')
 
     def _stop(self):
@@ -141,6 +164,21 @@ class State_machine():
         except Exception:
             return False # Bad variable name or invalid value string.
 
+    def _set_variables(self, v_values):
+        # Set variables from list of (v_name, value, evaluate), where value is evaluated
+        # with eval if evaluate is True.  Returns list of (v_name, repr(value)) for 
+        # the variables set OK.
+        set_OK = []
+        for v_name, value, evaluate in v_values:
+            try:
+                if evaluate:
+                    value = eval(value)
+                setattr(self.smd.v, v_name, value)
+                set_OK.append((v_name, repr(value)))
+            except Exception:
+                pass # Invalid value string.
+        return set_OK
+
     def _get_variable(self, v_name):
         try:
             return getattr(self.smd.v, v_name)
@@ -0,0 +1,85 @@
+# Benchmark of saving analog data chunks to .pca files, comparing Data_logger.save_analog_chunk
+# which builds the timestamp and value columns of each chunk as a single array with one
+# write per chunk and flushes files on a time based policy, with the previous implementation
+# which wrote each timestamp and value separately and flushed after every chunk.  Chunks
+# for several 1kHz analog inputs are saved with each implementation, the files written are
+# checked to be identical and the save time per second of recorded data is printed.  The
+# save time and file size of the chunked .pcc analog format are also printed.
+# Usage: python analog_benchmark.py
+
+import os
+import sys
+import time
+import random
+import tempfile
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from com.data_logger import Data_logger
+
+# Previous implementation -------------------------------------------------------
+
+def legacy_save_analog_chunk(self, ID, sampling_rate, timestamp, data_array):
+    if not self.analog_files[ID]:
+        file_name = os.path.splitext(self.file_path)[0] + '_' + \
+                        self.ID2name_hw[ID] + '.pca'
+        self.analog_files[ID] = open(file_name, 'wb')
+    ms_per_sample = 1000 / sampling_rate
+    for i, x in enumerate(data_array):
+        t = int(timestamp + i*ms_per_sample)
+        self.analog_files[ID].write(t.to_bytes(4,'little', signed=True))
+        self.analog_files[ID].write(x.to_bytes(4,'little', signed=True))
+    self.analog_files[ID].flush()
+
+# Benchmark ---------------------------------------------------------------------
+
+def recorded_chunks(n_inputs, sampling_rate, chunk_size, duration, high_res):
+    # Return list of analog chunks (ID, sampling_rate, timestamp, data_array) as output
+    # by Pycboard.process_data for n_inputs inputs recorded for duration seconds.
+    chunks = []
+    chunk_ms = 1000*chunk_size/sampling_rate
+    for k in range(int(duration*sampling_rate/chunk_size)):
+        for ID in range(1, n_inputs+1):
+            timestamp = int(k*chunk_ms) + (random.randint(0, 999)/1000 if high_res else 0)
+            data_array = array('i', [random.randint(-2**20, 2**20) for i in range(chunk_size)])
+            chunks.append((ID, sampling_rate, timestamp, data_array))
+    return chunks
+
+def save(save_analog_chunk, chunks, data_dir, n_inputs, analog_format='pca'):
+    # Save chunks with save_analog_chunk, return save time and file contents.
+    sm_info = {'ID2name': {}, 'analog_inputs': 
+               {'input_{}'.format(ID): {'ID': ID, 'Fs': 1000} for ID in range(1, n_inputs+1)}}
+    data_logger = Data_logger(sm_info)
+    data_logger.file_path = os.path.join(data_dir, 'benchmark.txt')
+    data_logger.analog_format = analog_format
+    t0 = time.perf_counter()
+    for chunk in chunks:
+        save_analog_chunk(data_logger, *chunk)
+    save_time = time.perf_counter() - t0
+    data_logger.close_files()
+    contents = {}
+    for name in sm_info['analog_inputs']:
+        with open(os.path.join(data_dir, 'benchmark_{}.{}'.format(name, analog_format)), 'rb') as f:
+            contents[name] = f.read()
+    return save_time, contents
+
+if __name__ == '__main__':
+    random.seed(0)
+    n_inputs, sampling_rate, chunk_size, duration = 4, 1000, 100, 60
+    print('{} analog inputs at {}Hz, {} sample chunks, {}s of data.\n'.format(
+          n_inputs, sampling_rate, chunk_size, duration))
+    print('{:<18}{:>40}{:>26}'.format('Timestamps', 'Save time (ms per s of data)', 'File size (MB)'))
+    for high_res in (False, True):
+        chunks = recorded_chunks(n_inputs, sampling_rate, chunk_size, duration, high_res)
+        with tempfile.TemporaryDirectory() as data_dir:
+            legacy_t, legacy_contents = save(legacy_save_analog_chunk, chunks, data_dir, n_inputs)
+            new_t, new_contents = save(Data_logger.save_analog_chunk, chunks, data_dir, n_inputs)
+            pcc_t, pcc_contents = save(Data_logger.save_analog_chunk, chunks, data_dir, n_inputs, 'pcc')
+        assert new_contents == legacy_contents, 'Implementations wrote different files.'
+        pca_MB, pcc_MB = [sum(len(c) for c in contents.values())/1e6 
+                          for contents in (new_contents, pcc_contents)]
+        print('{:<18}{:>40}{:>26}'.format('microsecond' if high_res else 'millisecond', 
+              '{:.3f} / {:.3f} / {:.3f}'.format(1000*legacy_t/duration, 1000*new_t/duration, 
+              1000*pcc_t/duration), '{:.2f} / {:.2f}'.format(pca_MB, pcc_MB)))
+    print('\nSave times: previous .pca / current .pca / .pcc, file sizes: .pca / .pcc')
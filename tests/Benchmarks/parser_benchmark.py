@@ -0,0 +1,157 @@
+# Benchmark of the host serial data parser, comparing Pycboard.process_data which reads
+# all available bytes in one call and parses frames from a buffer, with the previous 
+# parser which read the serial line one frame field at a time.  A recorded byte stream
+# of events, prints and analog data chunks is delivered to each parser by a stand-in
+# serial object in blocks of fixed size, the parsed data is checked to be identical 
+# and the parse time per MB and number of serial reads are printed.
+# Usage: python parser_benchmark.py
+
+import os
+import sys
+import time
+import random
+import struct
+from io import BytesIO
+from array import array
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from com.pycboard import Pycboard
+
+# Recorded byte stream ---------------------------------------------------------
+
+def D_record(timestamp, ID):
+    header = struct.pack('<IH', timestamp, ID)
+    return b'D' + header + struct.pack('<H', sum(header))
+
+def P_record(timestamp, string):
+    data = string.encode()
+    header = struct.pack('<HI', len(data), timestamp)
+    return b'P' + header + struct.pack('<H', (sum(header) + sum(data)) & 0xffff) + data
+
+def A_chunk(ID, sampling_rate, timestamp, samples):
+    data = array('H', samples)
+    header = b'H' + struct.pack('<HHHI', ID, sampling_rate, 2*len(data), timestamp)
+    return b'A' + header + struct.pack('<H', (sum(header) + sum(data)) & 0xffff) + data.tobytes()
+
+def recorded_stream(duration_s=60, event_rate=50, sampling_rate=5000, chunk_size=256, frame_headers=True):
+    # Return bytes output by a board running for duration_s seconds, with events at 
+    # event_rate Hz, a print every second and one analog input at sampling_rate Hz.
+    # If frame_headers is False frames are output without the frame header used by
+    # the current protocol, as expected by the previous parser.
+    frames = []
+    for t in range(duration_s*1000):
+        if random.random() < event_rate/1000:
+            frames.append(D_record(t, random.randint(1,10)))
+        if t % 1000 == 0:
+            frames.append(P_record(t, 'trial {} reward {}'.format(t//1000, random.random()))) 
+        if (t+1) % (1000*chunk_size//sampling_rate) == 0:
+            frames.append(A_chunk(11, sampling_rate, t, [random.randint(0,4095) for i in range(chunk_size)]))
+    if frame_headers:
+        frames = [bytes([0xA5, n % 256, (n % 256) ^ 0xFF]) + frame for n, frame in enumerate(frames)]
+    return b''.join(frames)
+
+class Recorded_serial():
+    # Stand-in for serial port which makes recorded data available block_size bytes at a time,
+    # reads of more bytes than are available return once the requested bytes have arrived.
+    def __init__(self, data, block_size):
+        self.data = BytesIO(data)
+        self.n_bytes = len(data)
+        self.block_size = block_size
+        self.n_available = 0
+        self.n_reads = 0
+
+    def inWaiting(self):
+        if not self.n_available: # Next block arrives.
+            self.n_available = min(self.block_size, self.n_bytes - self.data.tell())
+        return self.n_available
+
+    def read(self, n=1):
+        self.n_reads += 1
+        data = self.data.read(n)
+        self.n_available = max(self.n_available - len(data), 0)
+        return data
+
+# Previous parser for comparison -----------------------------------------------
+
+def legacy_process_data(board):
+    new_data = []
+    while board.serial.inWaiting() > 0:
+        new_byte = board.serial.read(1)  
+        if new_byte == b'A': # Analog data, 13 byte header + variable size content.
+            data_header = board.serial.read(13)
+            typecode      = data_header[0:1].decode()             
+            ID            = int.from_bytes(data_header[1:3], 'little')
+            sampling_rate = int.from_bytes(data_header[3:5], 'little')
+            data_len      = int.from_bytes(data_header[5:7], 'little')
+            timestamp     = int.from_bytes(data_header[7:11], 'little')
+            checksum      = int.from_bytes(data_header[11:13], 'little')
+            data_array    = array(typecode, board.serial.read(data_len))
+            if checksum == (sum(data_header[:-2]) + sum(data_array)) & 0xffff: # Checksum OK.
+                new_data.append(('A',ID, sampling_rate, timestamp, data_array))
+            else:
+                new_data.append(('!','bad checksum A'))
+        elif new_byte == b'D': # Event or state entry, 8 byte data header only.
+            data_header = board.serial.read(8)
+            timestamp = int.from_bytes(data_header[ :4], 'little')
+            ID        = int.from_bytes(data_header[4:6], 'little')
+            checksum  = int.from_bytes(data_header[6:8], 'little')
+            if checksum == sum(data_header[:-2]): # Checksum OK.
+                new_data.append(('D',timestamp, ID))
+            else:
+                new_data.append(('!','bad checksum D'))
+        elif new_byte in (b'P', b'V'): # User print statement or set variable, 8 byte data header + variable size content.
+            data_header = board.serial.read(8)
+            data_len  = int.from_bytes(data_header[ :2], 'little')
+            timestamp = int.from_bytes(data_header[2:6], 'little')
+            checksum  = int.from_bytes(data_header[6:8], 'little')
+            data_bytes = board.serial.read(data_len)
+            if not checksum == (sum(data_header[:-2]) + sum(data_bytes)) & 0xffff: # Bad checksum.
+                new_data.append(('!','bad checksum ' + new_byte.decode()))
+                continue
+            new_data.append((new_byte.decode(),timestamp, data_bytes.decode()))
+    if new_data:
+        board.data_logger.process_data(new_data)
+
+# Benchmark -------------------------------------------------------------------
+
+class Collector():
+    # Stand-in for data logger which stores parsed data.
+    def __init__(self): self.data = []
+    def process_data(self, new_data): self.data.extend(new_data)
+
+def parse(process_data, stream, block_size):
+    # Parse stream delivered in blocks of block_size bytes, return parsed data, 
+    # parse time (s) and number of serial reads.
+    board = Pycboard.__new__(Pycboard)
+    board.serial = Recorded_serial(stream, block_size)
+    board.input_buffer = bytearray()
+    board.next_seq = 0
+    board.resyncing = False
+    board.skipped_bytes = 0
+    board.reader_thread = None
+    board.reader_queue = deque()
+    board.variable_requests = {}
+    board.clock_estimator = None
+    board.data_logger = Collector()
+    board.sm_info = {'variables': {}}
+    t0 = time.perf_counter()
+    while board.serial.data.tell() < len(stream):
+        process_data(board)
+    return board.data_logger.data, time.perf_counter()-t0, board.serial.n_reads
+
+if __name__ == '__main__':
+    random.seed(0)
+    legacy_stream = recorded_stream(frame_headers=False)
+    random.seed(0)
+    stream = recorded_stream()
+    MB = len(stream)/1e6
+    print('Recorded stream: {:.2f} MB\n'.format(MB))
+    print('{:<12}{:>26}{:>26}'.format('Block size', 'Parse time (s/MB)', 'Serial reads'))
+    for block_size in (64, 1024, 16384):
+        legacy_data, legacy_t, legacy_reads = parse(legacy_process_data, legacy_stream, block_size)
+        new_data, new_t, new_reads = parse(Pycboard.process_data, stream, block_size)
+        assert new_data == legacy_data, 'Parsers output different data.'
+        print('{:<12}{:>26}{:>26}'.format(block_size, '{:.3f} / {:.3f}'.format(legacy_t/MB, new_t/MB),
+                                          '{} / {}'.format(legacy_reads, new_reads)))
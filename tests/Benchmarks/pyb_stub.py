@@ -0,0 +1,100 @@
+# Minimal stand-ins for the micropython builtins and pyb module that allow the
+# pyControl framework to be imported under CPython for benchmarking.  Import
+# this module before importing anything from the pyControl package.
+
+import os
+import sys
+import time
+import types
+import builtins
+
+# Add top level pyControl folder to path to allow imports.
+top_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if not top_dir in sys.path: sys.path.insert(0, top_dir)
+
+# Micropython builtins.
+
+builtins.const = lambda x: x
+
+micropython = types.ModuleType('micropython')
+micropython.native = lambda f: f
+micropython.viper  = lambda f: f
+micropython.const  = builtins.const
+builtins.micropython = micropython
+sys.modules['micropython'] = micropython
+
+# pyb module.
+
+_t0 = time.perf_counter()
+
+def millis():
+    return int((time.perf_counter()-_t0)*1e3)
+
+def micros():
+    return int((time.perf_counter()-_t0)*1e6)
+
+def elapsed_millis(start):
+    return millis() - start
+
+def elapsed_micros(start):
+    return micros() - start
+
+def rng():
+    return int.from_bytes(os.urandom(4), 'little') >> 2
+
+class Timer():
+    def __init__(self, n, **kwargs): pass
+    def init(self, **kwargs): pass
+    def callback(self, f): pass
+    def deinit(self): pass
+    def counter(self, value=None): return 0
+
+class USB_VCP():
+    # Discards output and never has input available.
+    def __init__(self): self.n_bytes_sent = 0
+    def send(self, data, timeout=0): self.n_bytes_sent += len(data)
+    def write(self, data): self.n_bytes_sent += len(data)
+    def read(self, n=None): return b''
+    def recv(self, buf, timeout=0): return 0
+    def any(self): return False
+    def setinterrupt(self, c): pass
+
+class Pin():
+    IN = OUT = PULL_UP = PULL_DOWN = PULL_NONE = 0
+    def __init__(self, *args, **kwargs): self._value = 0
+    def value(self, v=None):
+        if v is None: return self._value
+        self._value = v
+
+class ExtInt():
+    IRQ_RISING = IRQ_FALLING = IRQ_RISING_FALLING = 0
+    def __init__(self, *args, **kwargs): pass
+
+class ADC():
+    def __init__(self, pin): pass
+    def read(self): return 0
+
+# Micropython gc heap usage functions, allocation is simulated as growing by 50 bytes per
+# millisecond since the last collection on a 100kB heap.
+
+import gc
+_gc_collect = gc.collect
+_last_collect_ms = 0
+
+def _gc_collect_stub():
+    global _last_collect_ms
+    _last_collect_ms = millis()
+    return _gc_collect()
+
+def _mem_alloc():
+    return min(20000 + 50*(millis() - _last_collect_ms), 100000)
+
+gc.collect = _gc_collect_stub
+gc.mem_alloc = _mem_alloc
+gc.mem_free = lambda: 100000 - _mem_alloc()
+
+pyb = types.ModuleType('pyb')
+for _name in ('millis', 'micros', 'elapsed_millis', 'elapsed_micros', 'rng',
+              'Timer', 'USB_VCP', 'Pin', 'ExtInt', 'ADC'):
+    setattr(pyb, _name, globals()[_name])
+sys.modules['pyb'] = pyb
@@ -0,0 +1,171 @@
+# Micro-benchmark of raw REPL command round trip latency, comparing the Pyboard command
+# transport which uses raw-paste mode and blocking reads with the previous transport 
+# which wrote commands in 256 byte chunks every 10ms and polled for data every 100ms.
+# Commands are run on a stand-in board which implements the MicroPython raw REPL and
+# raw-paste protocols on a pseudo-terminal and executes commands using CPython, with
+# and without raw-paste support to also test the fallback to the standard raw REPL.
+# Requires a platform with pseudo-terminals (Linux or macOS).
+# Usage: python repl_benchmark.py
+
+import os
+import sys
+import pty
+import tty
+import time
+import threading
+import contextlib
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from com.pyboard import Pyboard, PyboardError
+
+# Stand-in board ---------------------------------------------------------------
+
+banner = b'raw REPL; CTRL-B to exit\r\n>'
+
+class Standin_board():
+    # Raw REPL on the master side of a pseudo-terminal, the slave device path is 
+    # opened by the Pyboard being tested.
+    def __init__(self, raw_paste=True, window_size=128):
+        self.raw_paste = raw_paste
+        self.window_size = window_size
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.device = os.ttyname(slave)
+        self.namespace = {}
+        self.pending = bytearray() # Data received but not yet processed.
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def read(self, n=4096):
+        # Read data, returning data received but not yet processed first.
+        if self.pending:
+            data = bytes(self.pending[:n])
+            del self.pending[:n]
+            return data
+        return os.read(self.master, n)
+
+    def write(self, data):
+        os.write(self.master, data)
+
+    def execute(self, command):
+        # Execute command, return normal and error output.
+        stdout, stderr = StringIO(), ''
+        try:
+            with contextlib.redirect_stdout(stdout):
+                exec(command, self.namespace)
+        except Exception as e:
+            stderr = repr(e)
+        return stdout.getvalue().encode() + b'\x04' + stderr.encode() + b'\x04>'
+
+    def run(self):
+        command = bytearray()
+        self.pending = bytearray()
+        while True:
+            self.pending += self.read()
+            while self.pending:
+                if self.pending[:3] == b'\x05A\x01' and not command and self.raw_paste:
+                    del self.pending[:3]
+                    self.write(b'R\x01' + self.window_size.to_bytes(2, 'little'))
+                    self.paste_mode()
+                    continue
+                c = self.pending.pop(0)
+                if c == 1: # ctrl-A, (re)enter raw REPL.
+                    command = bytearray()
+                    self.write(banner)
+                elif c == 4: # ctrl-D, soft reset if no command else execute command.
+                    if command:
+                        self.write(b'OK')
+                        self.write(self.execute(bytes(command)))
+                        command = bytearray()
+                    else:
+                        self.write(b'OK\r\nMPY: soft reboot\r\n' + banner)
+                elif c in (2, 3, 13) and not command: # ctrl-B, ctrl-C or return.
+                    pass
+                else:
+                    command.append(c)
+
+    def paste_mode(self):
+        # Receive command with window flow control and execute it.
+        command = bytearray()
+        n_window = 0 # Bytes received in current window.
+        while True:
+            while self.pending:
+                c = self.pending.pop(0)
+                if c == 4: # End of data.
+                    self.write(b'\x04')
+                    self.write(self.execute(bytes(command)))
+                    return
+                command.append(c)
+                n_window += 1
+                if n_window == self.window_size:
+                    n_window = 0
+                    self.write(b'\x01')
+            self.pending += self.read()
+
+# Previous transport for comparison --------------------------------------------
+
+class Legacy_pyboard(Pyboard):
+
+    def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
+        data = self.serial.read(min_num_bytes)
+        if data_consumer:
+            data_consumer(data)
+        timeout_count = 0
+        while True:
+            if data.endswith(ending):
+                break
+            elif self.serial.inWaiting() > 0:
+                new_data = self.serial.read(1)
+                data = data + new_data
+                if data_consumer:
+                    data_consumer(new_data)
+                timeout_count = 0
+            else:
+                timeout_count += 1
+                if timeout is not None and timeout_count >= 10 * timeout:
+                    break
+                time.sleep(0.1)
+        return data
+
+    def exec_raw_no_follow(self, command):
+        if isinstance(command, bytes):
+            command_bytes = command
+        else:
+            command_bytes = bytes(command, encoding='utf8')
+        for i in range(0, len(command_bytes), 256):
+            self.serial.write(command_bytes[i:min(i + 256, len(command_bytes))])
+            time.sleep(0.01)
+        self.serial.write(b'\x04')
+        data = self.serial.read(2)
+        if data != b'OK':
+            raise PyboardError('could not exec command')
+
+# Benchmark -------------------------------------------------------------------
+
+def round_trip_ms(pyboard_class, raw_paste, command, n_reps):
+    # Return mean time to execute command on stand-in board (ms).
+    board = Standin_board(raw_paste=raw_paste)
+    pyboard = pyboard_class(board.device)
+    pyboard.enter_raw_repl()
+    pyboard.exec(command) # First command determines whether raw-paste is used.
+    t0 = time.perf_counter()
+    for i in range(n_reps):
+        pyboard.exec(command)
+    pyboard.close()
+    return (time.perf_counter()-t0)/n_reps*1000
+
+commands = [('eval 1+1', 'print(1+1)'),
+            ('4kB command', 'x = ' + repr('a'*4000) + '\nprint(len(x))')]
+
+if __name__ == '__main__':
+    n_reps = 10
+    print('Command round trip time (ms), previous transport / current transport.\n')
+    print('{:<20}'.format('Board') + ''.join(['{:>24}'.format(name) for name, c in commands]))
+    for raw_paste in (True, False):
+        row = '{:<20}'.format('raw-paste' if raw_paste else 'no raw-paste')
+        for name, command in commands:
+            t_legacy = round_trip_ms(Legacy_pyboard, raw_paste, command, n_reps)
+            t_new    = round_trip_ms(Pyboard, raw_paste, command, n_reps)
+            row += '{:>24}'.format('{:.1f} / {:.1f}'.format(t_legacy, t_new))
+        print(row)
@@ -0,0 +1,133 @@
+# Benchmark of importing pyControl data files with tools/data_import.Session, comparing the
+# single pass parser, which splits data lines into Numpy arrays and groups times by state
+# and event ID by sorting, with the previous implementation which looped over the lines of
+# the file once per line type and scanned all events once per state and event name.  A 
+# synthetic session file with 1M events is imported with each implementation, the public 
+# attributes of the sessions are checked to be identical and import times are printed.  The
+# import time of the binary session file (.pcs) converted from the text file is also printed.
+# Usage: python session_benchmark.py
+
+import os
+import sys
+import time
+import random
+import tempfile
+import numpy as np
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tools.data_import import Session, Event, convert_to_binary
+
+# Previous implementation -------------------------------------------------------
+
+class Legacy_session(Session):
+
+    def __init__(self, file_path, int_subject_IDs=True):
+
+        with open(file_path, 'r') as f:
+            print('Importing data file: '+os.path.split(file_path)[1])
+            all_lines = [line.strip() for line in f.readlines() if line.strip()]
+
+        self.file_name = os.path.split(file_path)[1]
+
+        info_lines = [line[2:] for line in all_lines if line[0]=='I']
+
+        self.experiment_name = next(line for line in info_lines if 'Experiment name' in line).split(' : ')[1]
+        self.task_name       = next(line for line in info_lines if 'Task name'       in line).split(' : ')[1]
+        subject_ID_string    = next(line for line in info_lines if 'Subject ID'      in line).split(' : ')[1]
+        datetime_string      = next(line for line in info_lines if 'Start date'      in line).split(' : ')[1]
+
+        if int_subject_IDs:
+            self.subject_ID = int(''.join([i for i in subject_ID_string if i.isdigit()]))
+        else:
+            self.subject_ID = subject_ID_string
+
+        self.datetime = datetime.strptime(datetime_string, '%Y/%m/%d %H:%M:%S')
+        self.datetime_string = self.datetime.strftime('%Y-%m-%d %H:%M:%S')
+
+        state_IDs = eval(next(line for line in all_lines if line[0]=='S')[2:])
+        event_IDs = eval(next(line for line in all_lines if line[0]=='E')[2:])
+
+        ID2name = {v: k for k, v in {**state_IDs, **event_IDs}.items()}
+
+        data_lines = [line[2:].split(' ') for line in all_lines if line[0]=='D']
+
+        self.events = [Event(float(dl[0]) if '.' in dl[0] else int(dl[0]), ID2name[int(dl[1])])
+                       for dl in data_lines]
+
+        self.times = {event_name: np.array([ev.time for ev in self.events if ev.name == event_name])  
+                      for event_name in ID2name.values()}
+
+        self.print_lines = [line[2:] for line in all_lines if line[0]=='P']
+
+        clock_lines = [line[2:].split(' ') for line in all_lines if line[0]=='C']
+        self.clock_sync = ({'offset': float(clock_lines[-1][1]), 'drift_ppm': float(clock_lines[-1][2]),
+                            'error_ms': float(clock_lines[-1][3])} if clock_lines else None)
+
+# Benchmark ---------------------------------------------------------------------
+
+def write_session_file(file_path, n_events, n_states, n_events_types, high_res):
+    # Write synthetic data file with n_events state entries and events, a two line print 
+    # every 1000 events and clock estimates every 10000 events.
+    states = {'state_{}'.format(i): i for i in range(1, n_states+1)}
+    events = {'event_{}'.format(i): n_states+i for i in range(1, n_events_types+1)}
+    with open(file_path, 'w', newline='\n') as f:
+        f.write('I Experiment name  : benchmark\nI Task name : benchmark_task\n'
+                'I Subject ID : m001\nI Start date : 2024/01/01 12:00:00\n\n')
+        f.write('S {}\n\nE {}\n\n'.format(states, events))
+        t = 0
+        for i in range(n_events):
+            t += random.randint(1, 20)
+            if high_res and random.random() < 0.5: # Hardware event with microsecond timestamp.
+                f.write('D {:.3f} {}\n'.format(t + random.randint(0, 999)/1000, 
+                                               random.randint(n_states+1, n_states+n_events_types)))
+            else:
+                f.write('D {} {}\n'.format(t, random.randint(1, n_states+n_events_types)))
+            if i % 1000 == 0:
+                f.write('P {} trial {} complete\nreward: {}\n'.format(t, i//1000, i%3))
+            if i % 10000 == 0:
+                f.write('C {} 1704110400.123456 12.345 0.250\n'.format(t))
+
+def import_time(session_class, file_path):
+    # Return session and time to import it, including building the events list.
+    t0 = time.perf_counter()
+    session = session_class(file_path)
+    session.events
+    return session, time.perf_counter() - t0
+
+def check_identical(session, legacy_session):
+    # Check public attributes of session match those of legacy session.
+    for attribute in ('file_name', 'experiment_name', 'task_name', 'subject_ID', 'datetime',
+                      'datetime_string', 'events', 'print_lines', 'clock_sync'):
+        assert getattr(session, attribute) == getattr(legacy_session, attribute), attribute
+    assert all(type(a.time) == type(b.time) for a, b in zip(session.events, legacy_session.events))
+    assert session.times.keys() == legacy_session.times.keys()
+    for name, times in legacy_session.times.items():
+        assert session.times[name].dtype == times.dtype and np.array_equal(session.times[name], times), name
+
+if __name__ == '__main__':
+    random.seed(0)
+    n_events, n_states, n_event_types = 1000000, 10, 10
+    print('{} events, {} states, {} event types.\n'.format(n_events, n_states, n_event_types))
+    results = []
+    for high_res in (False, True):
+        with tempfile.TemporaryDirectory() as data_dir:
+            file_path = os.path.join(data_dir, 'm001-2024-01-01-120000.txt')
+            write_session_file(file_path, n_events, n_states, n_event_types, high_res)
+            legacy_session, legacy_t = import_time(Legacy_session, file_path)
+            session, new_t = import_time(Session, file_path)
+            check_identical(session, legacy_session)
+            t0 = time.perf_counter()
+            session = Session(file_path)
+            lazy_t = time.perf_counter() - t0
+            convert_to_binary(file_path)
+            binary_session, binary_t = import_time(Session, file_path[:-4] + '.pcs')
+            check_identical(binary_session, legacy_session)
+            results.append((high_res, legacy_t, new_t, lazy_t, binary_t))
+    print('\n{:<18}{:>56}'.format('Timestamps', 'Import time (s)'))
+    for high_res, legacy_t, new_t, lazy_t, binary_t in results:
+        print('{:<18}{:>56}'.format('microsecond' if high_res else 'millisecond', 
+              '{:.2f} / {:.2f} / {:.2f} / {:.2f}'.format(legacy_t, new_t, lazy_t, binary_t)))
+    print('\nImport times: previous parser / current parser / current parser without building '
+          'events list / binary session file')
@@ -0,0 +1,112 @@
+# Benchmark of the framework Timer class under CPython, comparing the heap based
+# timer with the previous sorted list implementation.  For each number of pending
+# timers the time per operation is printed for the operations used by tasks and
+# hardware objects: setting a timer that then elapses, reset_timer (disarm + set),
+# pause + unpause and timer_remaining.
+# Usage: python timer_benchmark.py
+
+import time
+import random
+
+import pyb_stub
+from pyControl import framework as fw
+
+# Previous sorted list timer implementation for comparison ---------------------
+
+class List_timer():
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.active_timers = []
+        self.paused_timers = []
+        self.available = False
+
+    def set(self, interval, event_type, event_data):
+        self.active_timers.append((fw.current_time+int(interval), event_type, event_data))
+        self.active_timers.sort(reverse=True)
+
+    def check(self):
+        self.available = bool(self.active_timers) and (self.active_timers[-1][0] <= fw.current_time)
+
+    def get(self):
+        event_tuple = self.active_timers.pop()
+        self.available = bool(self.active_timers) and (self.active_timers[-1][0] <= fw.current_time)
+        return event_tuple
+
+    def disarm(self, event_ID):
+        self.active_timers = [t for t in self.active_timers 
+                              if not (t[2] == event_ID and (t[1] in (fw.event_typ, fw.timer_typ)))]
+        self.paused_timers = [t for t in self.paused_timers if not t[2] == event_ID]
+
+    def pause(self, event_ID):
+        self.paused_timers += [(t[0]-fw.current_time,t[1], t[2]) for t in self.active_timers 
+                               if (t[2] == event_ID and (t[1] in (fw.event_typ, fw.timer_typ)))]
+        self.active_timers = [t for t in self.active_timers 
+                              if not (t[2] == event_ID and (t[1] in (fw.event_typ, fw.timer_typ)))]
+
+    def unpause(self, event_ID):
+        self.active_timers += [(t[0]+fw.current_time,t[1], t[2]) for t in self.paused_timers if t[2] == event_ID]
+        self.paused_timers = [t for t in self.paused_timers if not t[2] == event_ID]
+        self.active_timers.sort(reverse=True)
+
+    def remaining(self,event_ID):
+        try:
+            return next(t[0]-fw.current_time for t in reversed(self.active_timers) 
+                        if (t[1] == fw.event_typ and t[2] == event_ID))
+        except StopIteration:
+            return 0
+
+# Benchmark -------------------------------------------------------------------
+
+test_ID = 0 # Event ID used for timers being benchmarked.
+
+def fill(timer, n_pending):
+    # Reset timer and add n_pending timers that do not elapse during benchmark, including
+    # one for test_ID so each operation acts on a pending timer.
+    fw.current_time = 0
+    timer.reset()
+    for i in range(n_pending-1):
+        timer.set(random.randint(10**6, 10**7), fw.timer_typ, i+1)
+    timer.set(random.randint(10**6, 10**7), fw.event_typ, test_ID)
+
+def time_per_op(timer, n_pending, operation, n_reps):
+    fill(timer, n_pending)
+    t0 = time.perf_counter()
+    for i in range(n_reps):
+        operation(timer)
+    return (time.perf_counter()-t0)/n_reps*1e6
+
+def set_elapse(timer):
+    timer.set(0, fw.timer_typ, test_ID)
+    timer.check()
+    timer.get()
+
+def reset_timer(timer):
+    timer.disarm(test_ID)
+    timer.set(1000, fw.timer_typ, test_ID)
+
+def pause_unpause(timer):
+    timer.pause(test_ID)
+    timer.unpause(test_ID)
+
+def remaining(timer):
+    timer.remaining(test_ID)
+
+operations = [('set & elapse', set_elapse),
+              ('reset_timer', reset_timer),
+              ('pause & unpause', pause_unpause),
+              ('timer_remaining', remaining)]
+
+if __name__ == '__main__':
+    n_reps = 2000
+    print('Time per operation (us), sorted list timer / heap timer.\n')
+    print('{:<16}'.format('Pending timers') + ''.join(['{:>20}'.format(name) for name, op in operations]))
+    for n_pending in (10, 100, 1000):
+        row = '{:<16}'.format(n_pending)
+        for name, operation in operations:
+            t_list = time_per_op(List_timer(), n_pending, operation, n_reps)
+            t_heap = time_per_op(fw.Timer()  , n_pending, operation, n_reps)
+            row += '{:>20}'.format('{:.2f} / {:.2f}'.format(t_list, t_heap))
+        print(row)
@@ -0,0 +1,66 @@
+# Task for testing the framework in tickless mode.  Run the task by calling 
+# board.setup_state_machine('tickless_test') and then board.start_framework(tickless=True)
+# on a Pycboard connected to the pyboard.  The task repeatedly sets timers with intervals
+# between 1 and 20ms and checks that each is processed within 1ms of its trigger time, 
+# measured with the pyboard millisecond counter.  The blue LED should flash at 1Hz while
+# the test runs.  After 10 seconds the run stops and the number of timers tested and the
+# maximum timer lateness are printed, the red LED should not illuminate.
+
+import pyb
+import pyControl.framework as fw
+from pyControl.utility import *
+from devices import *
+
+# Hardaware
+
+blue_LED = Digital_output('B4')
+red_LED  = Digital_output('A13')
+
+# States and events.
+
+states = ['testing']
+
+events = ['test_timer',
+          'LED_timer',
+          'stop_timer']
+
+initial_state = 'testing'
+
+# Variables.
+
+v.trigger_time = 0  # Time at which test timer should be processed (ms).
+v.n_timers = 0      # Number of test timers processed.
+v.max_late = 0      # Maximum time test timers were processed after trigger time (ms).
+
+# Define behaviour. 
+
+def set_test_timer():
+    interval = randint(1, 20)
+    v.trigger_time = pyb.elapsed_millis(fw.start_time) + interval
+    set_timer('test_timer', interval*ms)
+
+def run_start():
+    if not fw.tickless:
+        print('Error: framework is not running in tickless mode.')
+        red_LED.on()
+    set_test_timer()
+    set_timer('LED_timer', 0.5*second)
+    set_timer('stop_timer', 10*second)
+
+def testing(event):
+    if event == 'test_timer':
+        late = pyb.elapsed_millis(fw.start_time) - v.trigger_time
+        v.n_timers += 1
+        v.max_late = max(v.max_late, late)
+        if late > 1:
+            red_LED.on()
+        set_test_timer()
+    elif event == 'LED_timer':
+        blue_LED.toggle()
+        set_timer('LED_timer', 0.5*second)
+    elif event == 'stop_timer':
+        print('Timers tested: {}, maximum lateness: {}ms'.format(v.n_timers, v.max_late))
+        stop_framework()
+
+def run_end():
+    blue_LED.off()
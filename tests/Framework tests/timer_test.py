@@ -1,6 +1,8 @@
 # Task for testing that the timer functions are working OK.  Blue, green
 # and yellow LEDs should flash synchronously at 1Hz, red LED should not 
-# illuminate.
+# illuminate.  The test should also be run with the framework in tickless mode,
+# by starting the framework with Pycboard.start_framework(tickless=True),
+# behaviour should be identical.
 
 from pyControl.utility import *
 from devices import *
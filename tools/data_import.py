@@ -3,7 +3,9 @@
 
 import os
 import pickle
+import warnings
 import numpy as np
+from ast import literal_eval
 from datetime import datetime, date
 from collections import namedtuple
 
@@ -28,7 +30,8 @@ class Session():
       - events
           A list of all framework events and state entries in the order they occured. 
           Each entry is a namedtuple with fields 'time' & 'name', such that you can get the 
-          name and time of event/state entry x with x.name and x.time respectively.
+          name and time of event/state entry x with x.name and x.time respectively.  The list
+          is built when first accessed.
       - times
           A dictionary with keys that are the names of the framework events and states and 
           corresponding values which are Numpy arrays of all the times (in milliseconds since the
@@ -36,20 +39,85 @@ class Session():
       - print_lines
           A list of all the lines output by print statements during the framework run, each line starts 
           with the time in milliseconds at which it was printed.
+    file_path may be a text data file (.txt) or a binary session file (.pcs), which is much faster 
+    to import, see convert_to_binary.
     '''
 
     def __init__(self, file_path, int_subject_IDs=True):
 
-        # Load lines from file.
+        if os.path.splitext(file_path)[1] == '.pcs': # Binary session file.
+            self._import_binary(file_path, int_subject_IDs)
+            return
+
+        # Load lines from file, sorting them by type in a single pass.
 
         with open(file_path, 'r') as f:
             print('Importing data file: '+os.path.split(file_path)[1])
-            all_lines = [line.strip() for line in f.readlines() if line.strip()]
+            all_lines = f.read().split('\n')
+
+        header_lines, data_lines, clock_lines = [], [], []
+        self.print_lines = []
+        for line in all_lines:
+            line = line.strip()
+            if not line:
+                continue
+            line_type = line[0]
+            if line_type == 'D':
+                data_lines.append(line[2:])
+            elif line_type == 'P':
+                self.print_lines.append(line[2:])
+            elif line_type == 'C':
+                clock_lines.append(line[2:].split(' '))
+            elif line_type in ('I', 'S', 'E'):
+                header_lines.append(line)
 
         # Extract and store session information.
 
         self.file_name = os.path.split(file_path)[1]
 
+        ID2name = self._import_header(header_lines, int_subject_IDs)
+
+        # Extract and store session data.  Data lines 'time ID' are joined and parsed in one call.
+
+        data_string = ' '.join(data_lines)
+
+        # Timestamps are integer ms, or float ms if data was acquired with high_res timestamps.
+        dtype = float if '.' in data_string else int
+        try:
+            with warnings.catch_warnings(): # Older Numpy warns if string cannot be parsed to its end.
+                warnings.simplefilter('ignore', DeprecationWarning)
+                values = np.fromstring(data_string, dtype, sep=' ')
+        except ValueError: # Newer Numpy raises error if string cannot be parsed to its end.
+            values = []
+        if len(values) != 2*len(data_lines): # Some lines have extra fields, parse individually.
+            values = np.array([field for line in data_lines for field in line.split(' ')[:2]], dtype)
+        hi_res = np.array(['.' in line for line in data_lines], bool) if dtype == float else None
+
+        self._store_events(values[0::2], values[1::2].astype(int), hi_res, ID2name)
+
+        # Latest estimate of board clock relative to host wall-clock time, if recorded. Wall-clock
+        # time (s) of board time t (ms) is offset + t*(1 + drift_ppm*1e-6)/1000.
+
+        self.clock_sync = ({'offset': float(clock_lines[-1][1]), 'drift_ppm': float(clock_lines[-1][2]),
+                            'error_ms': float(clock_lines[-1][3])} if clock_lines else None)
+
+    def __getattr__(self, name):
+        # Build list of events on first access, as this is slow for long sessions.
+        if name == 'events' and '_event_IDs' in self.__dict__:
+            if self._event_hi_res is None:
+                times = self._event_times.tolist()
+            else:
+                times = [t if h else int(t) for t, h in 
+                         zip(self._event_times.tolist(), self._event_hi_res.tolist())]
+            names = map(self._ID2name.__getitem__, self._event_IDs.tolist())
+            self.events = list(map(Event, times, names))
+            del self._event_times, self._event_IDs, self._event_hi_res, self._ID2name
+            return self.events
+        raise AttributeError("'Session' object has no attribute '{}'".format(name))
+
+    def _import_header(self, all_lines, int_subject_IDs):
+        # Store session information from header lines and return dict mapping state and event IDs to names.
+
         info_lines = [line[2:] for line in all_lines if line[0]=='I']
 
         self.experiment_name = next(line for line in info_lines if 'Experiment name' in line).split(' : ')[1]
@@ -65,21 +133,65 @@ class Session():
         self.datetime = datetime.strptime(datetime_string, '%Y/%m/%d %H:%M:%S')
         self.datetime_string = self.datetime.strftime('%Y-%m-%d %H:%M:%S')
 
-        # Extract and store session data.
+        state_IDs = literal_eval(next(line for line in all_lines if line[0]=='S')[2:])
+        event_IDs = literal_eval(next(line for line in all_lines if line[0]=='E')[2:])
+
+        return {v: k for k, v in {**state_IDs, **event_IDs}.items()}
+
+    def _store_events(self, times, IDs, hi_res, ID2name):
+        # Store times of each state and event, grouped by ID by sorting, and the data used to 
+        # build the events list on first access.  hi_res is a boolean array indicating events 
+        # with microsecond resolution timestamps, or None if there are none.
+
+        self._event_times, self._event_IDs, self._event_hi_res, self._ID2name = times, IDs, hi_res, ID2name
 
-        state_IDs = eval(next(line for line in all_lines if line[0]=='S')[2:])
-        event_IDs = eval(next(line for line in all_lines if line[0]=='E')[2:])
+        order = np.argsort(IDs, kind='stable')
+        sorted_IDs = IDs[order]
+        group_starts = np.flatnonzero(np.diff(sorted_IDs)) + 1
+        group_IDs = sorted_IDs[np.concatenate([[0], group_starts])].tolist() if len(IDs) else []
+        groups = dict(zip(group_IDs, np.split(order, group_starts)))
 
-        ID2name = {v: k for k, v in {**state_IDs, **event_IDs}.items()}
+        self.times = {}
+        for ID, event_name in ID2name.items():
+            if ID not in groups:
+                self.times[event_name] = np.array([])
+            elif hi_res is not None and hi_res[groups[ID]].any():
+                self.times[event_name] = times[groups[ID]]
+            else:
+                self.times[event_name] = times[groups[ID]].astype(int)
 
-        data_lines = [line[2:].split(' ') for line in all_lines if line[0]=='D']
+    def _import_binary(self, file_path, int_subject_IDs):
+        # Import session from binary session file, see below for format.  Attributes are
+        # as if imported from the text data file, which has the same name.
 
-        self.events = [Event(int(dl[0]), ID2name[int(dl[1])]) for dl in data_lines]
+        print('Importing data file: '+os.path.split(file_path)[1])
+        records, strings = _load_pcs(file_path)
 
-        self.times = {event_name: np.array([ev.time for ev in self.events if ev.name == event_name])  
-                      for event_name in ID2name.values()}
+        self.file_name = os.path.splitext(os.path.split(file_path)[1])[0] + '.txt'
 
-        self.print_lines = [line[2:] for line in all_lines if line[0]=='P']
+        header_lines = [line.strip() for line in _pcs_string(strings, 8).split('\n') if line.strip()]
+        ID2name = self._import_header(header_lines, int_subject_IDs)
+
+        types = records['type']
+        events = records[(types == b'D') | (types == b'd')]
+        hi_res = events['type'] == b'd' # Events with microsecond resolution timestamps.
+        if hi_res.any():
+            self._store_events(events['time'], events['ID'].astype(int), hi_res, ID2name)
+        else:
+            self._store_events(events['time'].astype(int), events['ID'].astype(int), None, ID2name)
+
+        prints = records[types == b'P']
+        self.print_lines = [ # Continuation lines of multi-line prints are not included.
+            '{} {}'.format(_time_string(t), _pcs_string(strings, o).split('\n')[0]).rstrip()
+            for t, o in zip(prints['time'].tolist(), prints['ID'].tolist())]
+
+        clocks = records[types == b'C']
+        if len(clocks):
+            offset, drift_ppm, error_ms = _pcs_string(strings, int(clocks['ID'][-1])).split(' ')
+            self.clock_sync = {'offset': float(offset), 'drift_ppm': float(drift_ppm),
+                               'error_ms': float(error_ms)}
+        else:
+            self.clock_sync = None
 
 #----------------------------------------------------------------------------------
 # Experiment class
@@ -115,6 +227,8 @@ class Experiment():
         if len(new_files) > 0:
             print('Loading new data files..')
             for file_name in new_files:
+                if file_name[:-4] + '.pcs' in files: # Import binary session file if available.
+                    file_name = file_name[:-4] + '.pcs'
                 try:
                     self.sessions.append(Session(os.path.join(self.path, file_name), int_subject_IDs))
                 except Exception as error_message:
@@ -221,8 +335,198 @@ def _toDate(d): # Convert input to datetime.date object.
 # Load analog data
 #----------------------------------------------------------------------------------
 
-def load_analog_data(file_path):
-    '''Load a pyControl analog data file and return the contents as a numpy array
-    whose first column is timestamps (ms) and second data values.'''
+def load_analog_data(file_path, t_start=None, t_end=None, two_column=True):
+    '''Load a pyControl analog data file, either a chunked .pcc file or a .pca file of
+    timestamp, value pairs.  If two_column is True return a numpy array whose first column
+    is timestamps (ms) and second data values, as stored in .pca files.  If two_column is 
+    False return (times, values) where times are float ms and values have the sample type
+    sent by the board.  If t_start or t_end (ms) are specified only samples in that time
+    window are returned.  .pcc files are memory mapped and only chunks overlapping the
+    window are read, located using the file index.'''
+    with open(file_path, 'rb') as f:
+        chunked = f.read(4) == b'PCCF'
+    if chunked:
+        times, values = _load_pcc(file_path, t_start, t_end)
+        if not two_column:
+            return times, values
+        data = np.empty((len(values), 2), '<i')
+        data[:,0] = times.astype(int)
+        data[:,1] = values
+        return data
+    with open(file_path, 'rb') as f:
+        data = np.fromfile(f, dtype='<i').reshape(-1,2)
+    if t_start is not None or t_end is not None:
+        data = data[(data[:,0] >= (-np.inf if t_start is None else t_start)) &
+                    (data[:,0] <= ( np.inf if t_end   is None else t_end))]
+    return data if two_column else (data[:,0].astype(float), data[:,1])
+
+#----------------------------------------------------------------------------------
+# Binary session files
+#----------------------------------------------------------------------------------
+
+def convert_to_binary(path):
+    '''Convert a pyControl text data file (.txt) to a binary session file (.pcs) and strings
+    file (.pcsb) saved in the same folder, as written by the Data_logger if binary_session
+    is True.  If path is a folder, all text data files in the folder which do not already 
+    have a binary session file are converted.'''
+    if os.path.isdir(path):
+        files = os.listdir(path)
+        for file_name in files:
+            if file_name[-4:] == '.txt' and file_name[:-4] + '.pcs' not in files:
+                convert_to_binary(os.path.join(path, file_name))
+        return
+    print('Converting data file: ' + os.path.split(path)[1])
+    with open(path, 'r') as f:
+        all_lines = f.read().split('\n')
+    header_bytes, _ = pcs_strings([pcs_header(all_lines)], len(PCSB_FILE_HEADER))
+    records_bytes, strings_bytes = pcs_records(text_session_records(all_lines), 
+                                               len(PCSB_FILE_HEADER) + len(header_bytes))
+    file_stem = os.path.splitext(path)[0]
+    with open(file_stem + '.pcsb', 'wb') as f:
+        f.write(PCSB_FILE_HEADER + header_bytes + strings_bytes)
+    with open(file_stem + '.pcs', 'wb') as f:
+        f.write(PCS_FILE_HEADER + records_bytes)
+
+# Binary session file (.pcs) format, used by convert_to_binary and com/data_logger.py.  File 
+# header: magic 'PCSF' (4 bytes), format version (2 bytes), reserved (10 bytes).  Followed by
+# 16 byte records 't i c' where t time (ms) (float64), i ID (4 bytes), c record type (1 byte),
+# then 3 bytes padding.  Record types are 'D' state entry or event with integer ms timestamp
+# and 'd' with microsecond resolution timestamp, for which i is the state or event ID, and 'P'
+# print, 'V' variable, 'C' clock estimate and '!' error, for which i is the offset of the 
+# record's text in the strings file (.pcsb) and text is as in the text data file, including 
+# any continuation lines of multi-line prints.  Errors have time NaN.  The strings file has 
+# header magic 'PCSB' (4 bytes), format version (2 bytes), reserved (2 bytes), followed by 
+# strings each stored as length (4 bytes) and utf8 text.  The first string is the session 
+# header, i.e. the I, S and E lines of the text data file.
+
+PCS_VERSION = 1
+PCS_FILE_HEADER = b'PCSF' + PCS_VERSION.to_bytes(2, 'little') + bytes(10)
+PCSB_FILE_HEADER = b'PCSB' + PCS_VERSION.to_bytes(2, 'little') + bytes(2)
+PCS_RECORD = np.dtype({'names': ['time', 'ID', 'type'], 'formats': ['<f8', '<u4', 'S1'],
+                       'offsets': [0, 8, 12], 'itemsize': 16})
+
+def pcs_header(lines):
+    '''Return session header string stored in strings file from lines of text data file.'''
+    return '\n'.join([line.strip() for line in lines if line.strip()[:2] in ('I ', 'S ', 'E ')]) + '\n'
+
+def text_session_records(lines):
+    '''Convert lines of text data file into list of (time, ID, type) binary session file 
+    records, where ID is the record's text for print, variable, clock and error records.
+    Header lines are ignored and continuation lines are appended to the preceding print.'''
+    records = []
+    for line in lines:
+        line = line.strip()
+        line_type = line[0] if line[1:2] == ' ' else None
+        if line_type == 'D':
+            time_string, ID = line[2:].split(' ')[:2]
+            records.append((float(time_string), int(ID), b'd' if '.' in time_string else b'D'))
+        elif line_type in ('P', 'V', 'C'):
+            time_string, content = (line[2:].split(' ', 1) + [''])[:2]
+            records.append((float(time_string), content, line_type.encode()))
+        elif line_type == '!':
+            records.append((np.nan, line[2:], b'!'))
+        elif (line and line_type not in ('I', 'S', 'E') and 
+              records and records[-1][2] == b'P'): # Continuation of multi-line print output.
+            time, content, line_type = records[-1]
+            records[-1] = (time, content + '\n' + line, line_type)
+    return records
+
+def pcs_strings(strings, offset):
+    '''Return strings encoded for strings file and list of their file offsets, where offset
+    is the file offset at which the first string will be written.'''
+    offsets, chunks = [], []
+    for string in strings:
+        string = string.encode()
+        offsets.append(offset)
+        chunks.append(len(string).to_bytes(4, 'little') + string)
+        offset += 4 + len(string)
+    return b''.join(chunks), offsets
+
+def pcs_records(records, strings_offset):
+    '''Return bytes to append to binary session file and strings file for list of (time, 
+    ID, type) records.  IDs which are strings are stored in the strings file, starting at 
+    file offset strings_offset, and replaced by their offsets.'''
+    strings_bytes, offsets = pcs_strings([r[1] for r in records if type(r[1]) == str], 
+                                         strings_offset)
+    offsets = iter(offsets)
+    array = np.zeros(len(records), PCS_RECORD)
+    array['time'] = [r[0] for r in records]
+    array['ID']   = [next(offsets) if type(r[1]) == str else r[1] for r in records]
+    array['type'] = [r[2] for r in records]
+    return array.tobytes(), strings_bytes
+
+def _load_pcs(file_path):
+    # Return array of records from binary session file and contents of its strings file.
     with open(file_path, 'rb') as f:
-        return np.fromfile(f, dtype='<i').reshape(-1,2)
\ No newline at end of file
+        if f.read(4) != b'PCSF':
+            raise ValueError('Not a binary session file: ' + file_path)
+        n_records = (os.path.getsize(file_path) - 16)//PCS_RECORD.itemsize # Ignore incomplete record.
+        records = np.fromfile(f, PCS_RECORD, n_records, offset=12)
+    with open(os.path.splitext(file_path)[0] + '.pcsb', 'rb') as f:
+        strings = f.read()
+    return records, strings
+
+def _pcs_string(strings, offset):
+    # Return string stored at offset in strings file contents.
+    n = int.from_bytes(strings[offset:offset+4], 'little')
+    return strings[offset+4:offset+4+n].decode()
+
+def _time_string(t):
+    # Format timestamp as in text data file, integer ms unless time has fractional part.
+    return str(int(t)) if float(t).is_integer() else '{:.3f}'.format(t)
+
+# Chunked analog file (.pcc) format, see com/data_logger.py.
+
+PCC_CHUNK_HEADER = np.dtype([('start', '<f8'), ('rate', '<u2'), ('typecode', 'S1'), 
+                             ('pad', 'u1'), ('n', '<u4')])
+PCC_INDEX_ENTRY = np.dtype([('offset', '<u8'), ('start', '<f8'), ('first_sample', '<u8')])
+PCC_FOOTER = np.dtype([('index_offset', '<u8'), ('n_entries', '<u4'), ('magic', 'S4')])
+
+def _pcc_chunk_index(mm):
+    # Return file offsets and start times of chunks in memory mapped .pcc file, read from
+    # file index if present, otherwise by scanning chunk headers, e.g. if the recording 
+    # did not end cleanly.
+    if len(mm) >= 8 + PCC_FOOTER.itemsize:
+        footer = np.frombuffer(mm, PCC_FOOTER, 1, len(mm) - PCC_FOOTER.itemsize)[0]
+        if footer['magic'] == b'PCCI':
+            index = np.frombuffer(mm, PCC_INDEX_ENTRY, int(footer['n_entries']),
+                                  int(footer['index_offset']))
+            return index['offset'].astype(int), index['start']
+    offsets, starts = [], []
+    offset = 8 # Skip file header.
+    while offset + PCC_CHUNK_HEADER.itemsize <= len(mm):
+        header = np.frombuffer(mm, PCC_CHUNK_HEADER, 1, offset)[0]
+        end = offset + PCC_CHUNK_HEADER.itemsize + int(header['n'])*_pcc_dtype(header).itemsize
+        if end > len(mm): # Incomplete chunk.
+            break
+        offsets.append(offset)
+        starts.append(header['start'])
+        offset = end
+    return np.array(offsets, int), np.array(starts, float)
+
+def _pcc_dtype(header):
+    # Return numpy dtype of samples in chunk with header.
+    return np.dtype('<' + header['typecode'].decode())
+
+def _load_pcc(file_path, t_start, t_end):
+    # Return sample times (ms) and values from chunked analog file in window t_start, t_end.
+    mm = np.memmap(file_path, np.uint8, mode='r')
+    offsets, starts = _pcc_chunk_index(mm)
+    # Select chunks from the last starting at or before t_start to the last starting at or before t_end.
+    first = max(np.searchsorted(starts, t_start, 'right') - 1, 0) if t_start is not None else 0
+    last = np.searchsorted(starts, t_end, 'right') if t_end is not None else len(starts)
+    times, values = [], []
+    for offset in offsets[first:last]:
+        header = np.frombuffer(mm, PCC_CHUNK_HEADER, 1, offset)[0]
+        ms_per_sample = 1000 / int(header['rate'])
+        start, n = float(header['start']), int(header['n'])
+        times.append(start + np.arange(n)*ms_per_sample)
+        values.append(np.frombuffer(mm, _pcc_dtype(header), n, offset + PCC_CHUNK_HEADER.itemsize))
+    if not values:
+        return np.zeros(0), np.zeros(0, 'i')
+    times, values = np.concatenate(times), np.concatenate(values)
+    if t_start is not None or t_end is not None:
+        in_window = ((times >= (-np.inf if t_start is None else t_start)) &
+                     (times <= ( np.inf if t_end   is None else t_end)))
+        times, values = times[in_window], values[in_window]
+    return times, values